@@ -0,0 +1,74 @@
+import json
+
+import pygame
+
+_atlases = {}  # (файл описания, масштаб) -> AnimationAtlas, строится один раз за процесс
+
+
+class AnimationAtlas:
+    """Все кадры всех анимаций персонажа в одной текстуре
+
+    Каждая анимация - две строки атласа: кадры вправо и они же, отражённые влево.
+    Кадр берётся готовым по (анимация, номер кадра, смотрит ли влево) - во время
+    игры ничего не масштабируется, не отражается и не создаётся.
+
+    specs - {имя: {"sheet": файл листа, "frames": кадров в листе, "fps": кадров в секунду}}
+
+    load_image - функция, которая по имени файла возвращает (картинку, rect)
+
+    scale - во сколько раз увеличить кадры"""
+
+    def __init__(self, specs, load_image, scale):
+        self.fps = {}
+        self.frames = {}  # (имя, влево) -> список кадров
+
+        sheets = {}
+        for name, spec in specs.items():
+            sheet = load_image(spec["sheet"])[0]
+            width = sheet.get_width() * scale
+            height = round(sheet.get_height() * scale)
+            if height % 2 != 0:
+                height -= 1
+                width -= 1
+            sheets[name] = pygame.transform.scale(sheet, (width, height))
+
+        atlas_width = max(sheet.get_width() for sheet in sheets.values())
+        atlas_height = sum(sheet.get_height() * 2 for sheet in sheets.values())
+        self.surface = pygame.Surface((atlas_width, atlas_height), pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+
+        y = 0
+        for name, spec in specs.items():
+            sheet = sheets[name]
+            count = spec["frames"]
+            frame_width = sheet.get_width() // count
+            height = sheet.get_height()
+            self.fps[name] = spec["fps"]
+            for reverse in (False, True):
+                frames = []
+                for i in range(count):
+                    frame = sheet.subsurface(frame_width * i, 0, frame_width, height)
+                    if reverse:
+                        frame = pygame.transform.flip(frame, True, False)
+                    # MAX по всем каналам на прозрачном фоне - точная копия вместе с альфой
+                    self.surface.blit(frame, (frame_width * i, y), special_flags=pygame.BLEND_RGBA_MAX)
+                    frames.append(self.surface.subsurface(frame_width * i, y, frame_width, height))
+                self.frames[(name, reverse)] = frames
+                y += height
+
+    def frame(self, name, index, reverse=False):
+        """Кадр index анимации name; reverse - смотрит влево"""
+        return self.frames[(name, reverse)][index]
+
+    def length(self, name):
+        return len(self.frames[(name, False)])
+
+
+def load_atlas(path, load_image, scale):
+    """Атлас анимаций из json-описания path; для одного файла и масштаба строится один раз"""
+    key = path, scale
+    if key not in _atlases:
+        with open(path, encoding="utf-8") as file:
+            specs = json.load(file)
+        _atlases[key] = AnimationAtlas(specs, load_image, scale)
+    return _atlases[key]
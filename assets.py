@@ -0,0 +1,107 @@
+import collections
+import os
+
+import pygame
+
+
+def surface_bytes(surface):
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+class AssetManager:
+    """Общий на весь процесс кэш картинок
+
+    Картинка с диска декодируется один раз, её увеличенные копии - тоже по разу на размер.
+    Ключ - (имя файла, размер или None для исходного, с альфой или без). Когда кэш
+    занимает больше budget байт, выбрасываются давно не нужные картинки (LRU), кроме
+    закреплённых: pin/unpin считают ссылки, так что ассеты текущего уровня не пропадут,
+    пока уровень не сменится. hits/misses/evictions - для отладочного режима.
+
+    directory - папка с картинками
+
+    budget - сколько байт можно держать в кэше"""
+
+    def __init__(self, directory="data", budget=256 * 1024 * 1024):
+        self.directory = directory
+        self.budget = budget
+        self.entries = collections.OrderedDict()  # ключ -> поверхность, от давно не нужных к свежим
+        self.sizes = {}  # ключ -> байт
+        self.pins = collections.Counter()  # ключ -> сколько раз закреплён
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def image(self, name, size=None, alpha=True):
+        """Картинка name из directory; size - (w, h), если нужна отмасштабированная копия
+
+        Возвращаемую поверхность делят все, кто её запросил, - рисовать на ней нельзя"""
+        key = name, size, alpha
+        surface = self.get(key)
+        if surface is not None:
+            return surface
+        if size is None:
+            fullname = os.path.join(self.directory, name)
+            try:
+                surface = pygame.image.load(fullname)
+            except FileNotFoundError:
+                print(f"Cannot load image: {fullname}")
+                raise SystemExit
+            surface = surface.convert_alpha() if alpha else surface.convert()
+        else:
+            surface = pygame.transform.scale(self.image(name, None, alpha), size)
+        self.put(key, surface)
+        return surface
+
+    def get(self, key):
+        """Поверхность по ключу или None (считается как попадание или промах)"""
+        surface = self.entries.get(key)
+        if surface is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return surface
+
+    def put(self, key, surface):
+        """Кладёт в кэш готовую поверхность (например, атлас уровня)"""
+        if key in self.entries:
+            self.used -= self.sizes[key]
+        self.entries[key] = surface
+        self.entries.move_to_end(key)
+        self.sizes[key] = surface_bytes(surface)
+        self.used += self.sizes[key]
+        self.evict()
+
+    def discard(self, key):
+        """Убирает картинку из кэша, если она там есть (например, чанк уровня, который больше не нужен)"""
+        if key in self.entries:
+            del self.entries[key]
+            self.used -= self.sizes.pop(key)
+
+    def pin(self, key):
+        self.pins[key] += 1
+
+    def unpin(self, key):
+        self.pins[key] -= 1
+        if self.pins[key] <= 0:
+            del self.pins[key]
+            self.evict()
+
+    def evict(self):
+        """Выбрасывает давно не нужные незакреплённые картинки, пока кэш не влезет в бюджет"""
+        if self.used <= self.budget:
+            return
+        for key in list(self.entries):
+            if self.used <= self.budget:
+                break
+            if key in self.pins:
+                continue
+            del self.entries[key]
+            self.used -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def stats(self):
+        """Строка для отладочного режима"""
+        return (f"ASSETS {len(self.entries)} шт. {self.used / 2 ** 20:.1f} МБ, "
+                f"hit {self.hits} miss {self.misses} evict {self.evictions}")
@@ -0,0 +1,90 @@
+import json
+
+import pygame
+
+
+class ParallaxLayer:
+    """Слой фона: картинка под размер экрана, повторяется по горизонтали
+
+    scroll - какую долю сдвига камеры (по x и y) проходит слой: 0 - стоит на месте,
+    1 - едет вместе с уровнем
+
+    height - высота слоя в высотах экрана; ширина - по пропорциям картинки"""
+
+    def __init__(self, image, scroll=(0.5, 0.5), height=1.0):
+        self.name = image
+        self.scroll = pygame.math.Vector2(scroll)
+        self.height = height
+        self.key = None  # ключ картинки в asset_manager, пока слой её держит
+        self.image = None
+
+    def resize(self, assets, screen_size):
+        """Масштабирует картинку под экран screen_size, берёт её из кэша assets и закрепляет там"""
+        source = assets.image(self.name, alpha=False)
+        height = round(screen_size[1] * self.height)
+        width = max(1, round(source.get_width() * height / source.get_height()))
+        key = self.name, (width, height), False
+        if key == self.key:
+            return
+        assets.pin(key)
+        self.image = assets.image(self.name, (width, height), alpha=False)
+        self.release(assets)
+        self.key = key
+
+    def release(self, assets):
+        if self.key:
+            assets.unpin(self.key)
+            self.key = None
+
+    def draw(self, surface, offset, bottom):
+        """Рисует видимую часть слоя
+
+        offset - сдвиг камеры, bottom - нижний край уровня в координатах экрана при offset = 0:
+        когда камера внизу уровня, низ картинки совпадает с низом экрана"""
+        width, height = self.image.get_size()
+        screen_w, screen_h = surface.get_size()
+        x = -round(offset.x * self.scroll.x) % width - width
+        # пока камера поднимается, слой уезжает вниз медленнее уровня, но не открывает край картинки
+        y = screen_h - height + round((bottom - screen_h - offset.y) * self.scroll.y)
+        if height >= screen_h:
+            y = min(max(y, screen_h - height), 0)
+        while x < screen_w:
+            surface.blit(self.image, (x, y))
+            x += width
+
+
+class Background:
+    """Фон уровня из слоёв параллакса, от дальнего к ближнему
+
+    Слои хранятся в размере экрана, а не уровня, так что память под фон не зависит
+    от карты; за кадр рисуется только то, что видно (пара блитов на слой).
+
+    layers - список ParallaxLayer"""
+
+    def __init__(self, layers):
+        self.layers = list(layers)
+
+    @classmethod
+    def load(cls, path):
+        """Слои из json: {"layers": [{"image": файл, "scroll": [x, y], "height": в высотах экрана}]}"""
+        with open(path, encoding="utf-8") as file:
+            specs = json.load(file)["layers"]
+        return cls(ParallaxLayer(spec["image"], spec.get("scroll", (0.5, 0.5)), spec.get("height", 1.0))
+                   for spec in specs)
+
+    def resize(self, assets, screen_size):
+        for layer in self.layers:
+            layer.resize(assets, screen_size)
+
+    def release(self, assets):
+        """Открепляет картинки слоёв в assets (фон больше не будет рисоваться)"""
+        for layer in self.layers:
+            layer.release(assets)
+
+    def covers(self, screen_size):
+        """Закрывает ли дальний слой весь экран (тогда экран перед фоном можно не заливать)"""
+        return bool(self.layers) and self.layers[0].image.get_height() >= screen_size[1]
+
+    def draw(self, surface, offset, bottom):
+        for layer in self.layers:
+            layer.draw(surface, offset, bottom)
@@ -0,0 +1,59 @@
+"""Сравнение pygame.sprite.spritecollide и SpatialGroup на картах разной ширины
+
+Запуск из корня репозитория: python benchmarks/collision_bench.py"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from spatial import SpatialGroup
+
+TILE = 48  # размер тайла в пикселях экрана
+HEIGHT = 27  # как в level1.tmx
+QUERIES = 2000  # примерно два запроса на кадр в течение ~17 секунд игры
+
+
+def make_tiles(width):
+    """Земля в 5 тайлов толщиной и редкие платформы, как на обычном уровне"""
+    tiles = []
+    for x in range(width):
+        for y in range(HEIGHT):
+            if y >= HEIGHT - 5 or (y == HEIGHT - 10 and x % 7 < 3):
+                sprite = pygame.sprite.Sprite()
+                sprite.rect = pygame.Rect(x * TILE, y * TILE, TILE, TILE)
+                tiles.append(sprite)
+    return tiles
+
+
+def bench(width):
+    tiles = make_tiles(width)
+    plain = pygame.sprite.Group(tiles)
+    grid = SpatialGroup(tiles, cell_size=TILE)
+
+    probe = pygame.sprite.Sprite()
+    probe.rect = pygame.Rect(0, 0, TILE, TILE * 2)
+    positions = [((i * 37) % (width * TILE), (HEIGHT - 7) * TILE + i % TILE) for i in range(QUERIES)]
+
+    start = time.perf_counter()
+    for pos in positions:
+        probe.rect.topleft = pos
+        pygame.sprite.spritecollide(probe, plain, False)
+    plain_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for pos in positions:
+        probe.rect.topleft = pos
+        grid.spritecollide(probe)
+    grid_time = time.perf_counter() - start
+
+    return len(tiles), plain_time / QUERIES * 1e6, grid_time / QUERIES * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'ширина':>8} {'тайлов':>8} {'spritecollide, мкс':>20} {'SpatialGroup, мкс':>20}")
+    for width in (120, 1200, 12000):
+        count, plain_us, grid_us = bench(width)
+        print(f"{width:>8} {count:>8} {plain_us:>20.1f} {grid_us:>20.1f}")
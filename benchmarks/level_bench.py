@@ -0,0 +1,309 @@
+"""Замеры загрузки уровня, обновления, столкновений и отрисовки на сгенерированных уровнях
+
+Для каждого размера генерируется TMX-уровень из тайлов игры: пол, случайные платформы
+(solid - доля твёрдых клеток в их рядах), шипы на платформах, ключи, сундуки и телепорты
+на полу. Игра запускается без окна (SDL-драйвер dummy), игрок бежит вправо и прыгает,
+и по отдельности замеряются:
+
+- compile - разбор TMX в скомпилированный уровень (level_cache.compile_level)
+- gen_level - загрузка скомпилированного уровня
+- update - all_sprites.update() за тик (вместе со столкновениями игрока)
+- collision - проверки столкновений игрока за тик (часть update)
+- draw - CameraGroup.custom_draw за кадр
+- frame - весь тик и кадр целиком
+
+Результат - таблица и (--output) JSON; с --baseline каждая медиана сравнивается с прошлым
+JSON, и если что-то стало медленнее больше чем на tolerance, скрипт выходит с кодом 1.
+
+Запуск из корня репозитория:
+    python benchmarks/level_bench.py --sizes 120x27,1200x27,12000x27 --output bench.json
+    python benchmarks/level_bench.py --baseline bench.json
+    python benchmarks/level_bench.py --make levels/big.tmx --sizes 2000x40  # только сгенерировать уровень"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import level_cache
+import replay
+
+TILESETS = os.path.join(ROOT, "levels", "tilesets")
+FORMAT = 1  # версия JSON с результатами
+
+# gid из тайлсетов игры (как в level1.tmx)
+OPENED_CHEST, COIN = 373, 618  # должны встретиться первыми: игра берёт их картинки по номерам 1 и 2
+GROUND_TOP, GROUND = 2, 18
+SPIKE = 436
+KEY = 371
+CHEST = 372
+PORTAL = 719
+
+FLOOR = 3  # толщина пола в тайлах
+SPAWN_CLEAR = 12  # сколько столбцов у точки появления остаются пустыми
+PLATFORM_STEP = 4  # через сколько тайлов по высоте идут ряды платформ
+METRICS = ("update", "collision", "draw", "frame")
+NOISE_MS = 0.05  # разница меньше этого - шум, а не регрессия
+
+
+def make_level(path, width, height, solid=0.3, spikes=0.1, items=0.05, chests=0.01, teleports=0.005, seed=1):
+    """Пишет TMX-уровень width x height тайлов
+
+    solid - доля твёрдых клеток в рядах платформ над полом, spikes - доля клеток платформ с шипами,
+    items и chests - доля столбцов с ключом и сундуком на полу, teleports - с телепортом.
+    Телепорты ведут на несуществующий уровень, чтобы ничего не грузилось в фоне."""
+    rng = random.Random(seed)
+    service = {(0, 0): OPENED_CHEST, (1, 0): COIN}
+    collide, env, decor, items_layer = {}, {}, {}, {}
+    objects = []
+    ground = height - FLOOR
+    for x in range(width):
+        collide[(x, ground)] = GROUND_TOP
+        for y in range(ground + 1, height):
+            collide[(x, y)] = GROUND
+    # платформы - отрезки по 3-7 тайлов на рядах через PLATFORM_STEP, так что стен, которые не перепрыгнуть, нет
+    for y in range(ground - PLATFORM_STEP, 1, -PLATFORM_STEP):
+        x = SPAWN_CLEAR
+        while x < width:
+            if rng.random() < solid / 5:
+                length = rng.randint(3, 7)
+                for cell in range(x, min(x + length, width)):
+                    collide[(cell, y)] = GROUND
+                    if rng.random() < spikes:
+                        env[(cell, y - 1)] = SPIKE
+                x += length
+            x += 1
+    for x in range(SPAWN_CLEAR, width):
+        if rng.random() < items:
+            items_layer[(x, ground - 1)] = KEY
+        elif rng.random() < chests:
+            decor[(x, ground - 1)] = CHEST
+        elif rng.random() < teleports:
+            objects.append({"name": "bench_missing.tmx", "type": "teleport", "gid": str(PORTAL),
+                            "x": str(x * 16), "y": str(ground * 16), "width": "16", "height": "32"})
+
+    root = ElementTree.Element("map", version="1.10", orientation="orthogonal", renderorder="right-down",
+                               width=str(width), height=str(height), tilewidth="16", tileheight="16",
+                               infinite="0")
+    tilesets = os.path.relpath(TILESETS, os.path.dirname(os.path.abspath(path)))
+    tileset = ElementTree.SubElement(root, "tileset", firstgid="1", name="Grass", tilewidth="16",
+                                     tileheight="16", tilecount="224", columns="16")
+    ElementTree.SubElement(tileset, "image", source=os.path.join(tilesets, "tilesheet_grass.png"),
+                           width="256", height="224")
+    for firstgid, name in ((225, "Dungeon.tsx"), (495, "Grass.tsx"), (719, "portal.tsx")):
+        ElementTree.SubElement(root, "tileset", firstgid=str(firstgid), source=os.path.join(tilesets, name))
+
+    def add_layer(name, cells):
+        layer = ElementTree.SubElement(root, "layer", name=name, width=str(width), height=str(height))
+        data = ElementTree.SubElement(layer, "data", encoding="csv")
+        data.text = "\n" + ",\n".join(",".join(str(cells.get((x, y), 0)) for x in range(width))
+                                      for y in range(height)) + "\n"
+
+    add_layer("service", service)
+    add_layer("collide", collide)
+    entities = ElementTree.SubElement(root, "objectgroup", name="entities")
+    ElementTree.SubElement(entities, "object", name="Spawn", type="Player", x="32", y=str((ground - 3) * 16))
+    for obj in objects:
+        ElementTree.SubElement(entities, "object", **obj)
+    add_layer("env2", decor)
+    add_layer("env", env)
+    add_layer("player", {})
+    add_layer("items", items_layer)
+    ElementTree.ElementTree(root).write(path, encoding="UTF-8", xml_declaration=True)
+
+
+class Timer:
+    """Подменяет метод obj.name обёрткой, которая запоминает длительность каждого вызова"""
+
+    def __init__(self, obj, name):
+        self.samples = []
+        original = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.samples.append((time.perf_counter() - start) * 1000)
+
+        setattr(obj, name, timed)
+
+    def take(self):
+        """Сумма с прошлого вызова take (несколько вызовов за тик считаются вместе)"""
+        total = sum(self.samples)
+        self.samples = []
+        return total
+
+
+class ScriptedInput:
+    """Ввод для игры вместо записи: бежим вправо, прыгаем раз в пол-секунды и сразу перезапускаемся после смерти"""
+
+    def __init__(self):
+        self.frame = 0
+
+    def next(self):
+        self.frame += 1
+        held = replay.KEY_BITS[pygame.K_d] | replay.KEY_BITS[pygame.K_LSHIFT] | replay.KEY_BITS[pygame.K_r]
+        if self.frame % 30 < 8:
+            held |= replay.KEY_BITS[pygame.K_SPACE]
+        return replay.FrameInput(held)
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {"mean": statistics.fmean(samples), "median": statistics.median(samples),
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))], "max": samples[-1]}
+
+
+def bench(main, folder, size, ticks, warmup, densities):
+    """Генерирует уровень размера size = (w, h), грузит его и гоняет ticks тиков"""
+    width, height = size
+    name = f"bench-{width}x{height}.tmx"
+    path = os.path.join(folder, name)
+    make_level(path, width, height, **densities)
+    scale = main.player.rect.width
+
+    start = time.perf_counter()
+    level_cache.compile_level(path, scale)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    # restart грузит "levels/<имя>", путь к временной папке задаём относительно levels
+    main.CURRENT_LEVEL = os.path.relpath(path, "levels")
+    random.seed(0)
+    start = time.perf_counter()
+    main.restart(main.CURRENT_LEVEL)
+    gen_level_ms = (time.perf_counter() - start) * 1000
+
+    main.input_replay = ScriptedInput()
+    timers = {
+        "update": Timer(main.all_sprites, "update"),
+        "draw": Timer(main.all_sprites, "custom_draw"),
+        "collision": [Timer(main.player, name) for name in
+                      ("check_x_collisions", "check_y_collisions", "check_touch_danger")],
+    }
+    samples = {metric: [] for metric in METRICS}
+    deaths = 0
+    for tick in range(warmup + ticks):
+        start = time.perf_counter()
+        alive = bool(main.player.groups())
+        main.game_tick()
+        main.draw_frame()
+        frame_ms = (time.perf_counter() - start) * 1000
+        if alive and not main.player.groups():
+            deaths += 1
+        measured = {"update": timers["update"].take(), "draw": timers["draw"].take(),
+                    "collision": sum(timer.take() for timer in timers["collision"]), "frame": frame_ms}
+        if tick >= warmup:
+            for metric in METRICS:
+                samples[metric].append(measured[metric])
+    for obj in (main.all_sprites, main.player):
+        for name in ("update", "custom_draw", "check_x_collisions", "check_y_collisions", "check_touch_danger"):
+            obj.__dict__.pop(name, None)  # убираем обёртки, дальше снова методы класса
+    main.input_replay = None
+
+    result = {"width": width, "height": height, "compile_ms": compile_ms, "gen_level_ms": gen_level_ms,
+              "sprites": len(main.all_sprites), "chunks_loaded": len(main.level_streamer.loaded),
+              "deaths": deaths, "player_x": main.player.rect.x}
+    for metric in METRICS:
+        result[f"{metric}_ms"] = summary(samples[metric])
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Печатает отношение к baseline для каждой медианы; возвращает список регрессий"""
+    regressions = []
+    print(f"\n{'уровень':>12} {'метрика':>12} {'было, мс':>10} {'стало, мс':>10} {'x':>6}")
+    for key, result in results["levels"].items():
+        old = baseline["levels"].get(key)
+        if old is None:
+            continue
+        for metric in ("compile_ms", "gen_level_ms") + tuple(f"{metric}_ms" for metric in METRICS):
+            before, after = old[metric], result[metric]
+            if isinstance(before, dict):
+                before, after = before["median"], after["median"]
+            ratio = after / before if before else float("inf")
+            slower = ratio > 1 + tolerance and after - before > NOISE_MS
+            if slower:
+                regressions.append((key, metric, before, after))
+            print(f"{key:>12} {metric:>12} {before:>10.2f} {after:>10.2f} {ratio:>6.2f}{'  <-' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="120x27,1200x27,12000x27", help="размеры уровней в тайлах через запятую")
+    parser.add_argument("--ticks", type=int, default=600, help="сколько тиков замерять на уровне")
+    parser.add_argument("--warmup", type=int, default=60, help="сколько тиков не считать (запекание первых чанков)")
+    parser.add_argument("--screen", default="1920x1080", help="разрешение экрана в памяти")
+    parser.add_argument("--native", action="store_true", help="рисовать в разрешении текстур (как main.py --native)")
+    parser.add_argument("--dirty", action="store_true", help="перерисовывать только изменения (как main.py --dirty)")
+    parser.add_argument("--solid", type=float, default=0.3, help="доля твёрдых клеток в рядах платформ")
+    parser.add_argument("--spikes", type=float, default=0.1, help="доля клеток платформ с шипами")
+    parser.add_argument("--items", type=float, default=0.05, help="доля столбцов с ключом")
+    parser.add_argument("--chests", type=float, default=0.01, help="доля столбцов с сундуком")
+    parser.add_argument("--teleports", type=float, default=0.005, help="доля столбцов с телепортом")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора уровней")
+    parser.add_argument("--output", metavar="FILE", help="записать результаты в JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="сравнить с прошлым JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="во сколько раз (сверх 1) можно замедлиться")
+    parser.add_argument("--make", metavar="FILE", help="только сгенерировать уровень первого размера в FILE")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.sizes.split(",")]
+    densities = {"solid": args.solid, "spikes": args.spikes, "items": args.items, "chests": args.chests,
+                 "teleports": args.teleports, "seed": args.seed}
+    if args.make:
+        make_level(args.make, *sizes[0], **densities)
+        return
+
+    os.chdir(ROOT)  # игра ищет data/ и levels/ от корня
+    import main as game  # после chdir и переменных окружения SDL
+
+    screen = tuple(int(n) for n in args.screen.split("x"))
+    with contextlib.redirect_stdout(io.StringIO()):  # игра много печатает
+        game.init_game(size=screen, headless=True, native=args.native, dirty=args.dirty)
+    results = {"format": FORMAT, "screen": list(screen), "ticks": args.ticks, "native": args.native,
+               "dirty": args.dirty, "densities": densities, "levels": {}}
+    print(f"{'уровень':>12} {'compile':>9} {'gen_level':>10} {'update':>8} {'collision':>10} "
+          f"{'draw':>8} {'frame':>8} {'p95 frame':>10}   (мс, медианы за тик)")
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = bench(game, folder, size, args.ticks, args.warmup, densities)
+            key = f"{size[0]}x{size[1]}"
+            results["levels"][key] = result
+            print(f"{key:>12} {result['compile_ms']:>9.1f} {result['gen_level_ms']:>10.1f} "
+                  f"{result['update_ms']['median']:>8.3f} {result['collision_ms']['median']:>10.3f} "
+                  f"{result['draw_ms']['median']:>8.2f} {result['frame_ms']['median']:>8.2f} "
+                  f"{result['frame_ms']['p95']:>10.2f}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            game.restart("level1.tmx")  # отпускаем временные уровни до удаления папки
+    game.level_loader.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nмедленнее больше чем на {args.tolerance:.0%}: {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
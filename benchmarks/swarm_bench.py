@@ -0,0 +1,154 @@
+"""Сравнение обновления примагниченных монет по одной (как было в Coin.update) и стаей Swarm
+
+Монеты не собираются, чтобы их число не менялось: меряется только полёт и проверка касания.
+Это верхняя граница: в игре к шагу стаи добавляются отрисовка и всё остальное.
+
+С --game монеты летят в настоящей игре (без окна): меряются целиком game_tick и draw_frame
+с N примагниченными монетами на level1; собранные монеты между тиками заменяются новыми.
+В конце печатается, сколько монет из проверенных ещё укладывается в кадр 60 FPS - это и есть
+настоящий предел игры на этой машине и этом разрешении.
+
+Запуск из корня репозитория:
+    python benchmarks/swarm_bench.py
+    python benchmarks/swarm_bench.py --game --counts 1000,2000,5000"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from swarm import Swarm
+
+TILE = 48  # размер монеты в пикселях экрана
+TICKS = 120  # две секунды игры
+BUDGET_MS = 1000 / 60
+
+
+def make_coins(count):
+    """Монеты, рассыпанные вокруг игрока на несколько экранов"""
+    rng = random.Random(1)
+    coins = []
+    for _ in range(count):
+        coin = pygame.sprite.Sprite()
+        coin.rect = pygame.Rect(rng.randrange(-4000, 4000), rng.randrange(-2000, 2000), TILE, TILE)
+        coin.random_acc = rng.randint(6, 12)
+        coin.shape = None
+        coins.append(coin)
+    return coins
+
+
+def per_sprite(coins, player):
+    """Старый путь: каждая монета сама летит к игроку и сама проверяет касание маской,
+    а Item.update ещё ищет её в списке подобранных предметов"""
+    picked_up_items = []
+    image = pygame.Surface((TILE, TILE))
+    for coin in coins:
+        coin.image = image
+        coin.mask = pygame.mask.from_surface(image)
+    player_sprite = pygame.sprite.Sprite()
+    player_sprite.rect = player
+    player_sprite.mask = pygame.mask.from_surface(pygame.Surface(player.size))
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(TICKS):
+        for coin in coins:
+            if pygame.sprite.collide_mask(coin, player_sprite):
+                hits += 1
+            target_rect = player
+            if picked_up_items and coin in picked_up_items:
+                target_rect = picked_up_items[picked_up_items.index(coin) - 1].rect
+            a = coin.rect.centerx - target_rect.centerx
+            b = coin.rect.centery - target_rect.centery
+            coin.rect.centerx -= a / coin.random_acc
+            coin.rect.centery -= b / coin.random_acc
+    return (time.perf_counter() - start) / TICKS * 1000
+
+
+def swarmed(coins, player):
+    """Новый путь: один векторный шаг и одна проверка касания на всю стаю"""
+    swarm = Swarm()
+    swarm.add(coins)
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(TICKS):
+        swarm.update(player.center)
+        hits += len(swarm.hits(player))
+    return (time.perf_counter() - start) / TICKS * 1000
+
+
+def spawn(game, count, rng):
+    """Досыпает примагниченных монет вокруг игрока, пока их не станет count"""
+    image = pygame.Surface((game.player.scale, game.player.scale))
+    x, y = game.player.rect.center
+    for _ in range(count - len(game.swarm)):
+        coin = game.Coin(image, (x + rng.randrange(-4000, 4000), y + rng.randrange(-2000, 2000)))
+        coin.add(game.all_sprites)
+        coin.attract()
+
+
+def in_game(game, count):
+    """Медианы (мс) game_tick и draw_frame с count монетами, летящими к игроку"""
+    rng = random.Random(1)
+    game.restart("level1.tmx")
+    ticks, draws = [], []
+    for _ in range(TICKS):
+        spawn(game, count, rng)  # вне замера: собранные монеты убывают
+        start = time.perf_counter()
+        game.game_tick()
+        middle = time.perf_counter()
+        game.draw_frame(0.5)  # между тиками, как при интерполяции
+        ticks.append((middle - start) * 1000)
+        draws.append((time.perf_counter() - middle) * 1000)
+    return sorted(ticks)[len(ticks) // 2], sorted(draws)[len(draws) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--game", action="store_true", help="мерить game_tick и draw_frame в игре без окна")
+    parser.add_argument("--counts", default="100,1000,5000,10000", help="числа монет через запятую")
+    parser.add_argument("--screen", default="1920x1080", help="разрешение экрана в памяти (для --game)")
+    args = parser.parse_args()
+    counts = [int(count) for count in args.counts.split(",")]
+
+    if args.game:
+        os.chdir(ROOT)  # игра ищет data/ и levels/ от корня
+        import main as game  # после chdir и переменных окружения SDL
+
+        screen = tuple(int(n) for n in args.screen.split("x"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            game.init_game(size=screen, headless=True)
+        print(f"{'монет':>8} {'game_tick, мс':>14} {'draw_frame, мс':>15} {'60 FPS':>8}")
+        fits = []
+        for count in counts:
+            with contextlib.redirect_stdout(io.StringIO()):  # игра много печатает
+                tick, draw = in_game(game, count)
+            if tick + draw < BUDGET_MS:
+                fits.append(count)
+            print(f"{count:>8} {tick:>14.3f} {draw:>15.3f} {'да' if tick + draw < BUDGET_MS else 'нет':>8}")
+        game.level_loader.shutdown()
+        if fits:
+            print(f"В кадр 60 FPS при {args.screen} укладывается до {max(fits)} монет (из проверенных)")
+        else:
+            print(f"При {args.screen} в кадр 60 FPS не укладывается ни одно из проверенных чисел монет")
+        return
+
+    player = pygame.Rect(0, 0, TILE, TILE * 2)
+    print(f"{'монет':>8} {'по одной, мс/тик':>18} {'Swarm, мс/тик':>15} {'60 FPS*':>8}")
+    for count in counts:
+        old = per_sprite(make_coins(count), player)
+        new = swarmed(make_coins(count), player)
+        print(f"{count:>8} {old:>18.3f} {new:>15.3f} {'да' if new < BUDGET_MS else 'нет':>8}")
+    print("* только шаг стаи без отрисовки; предел в игре показывает --game")
+
+
+if __name__ == "__main__":
+    main()
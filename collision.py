@@ -0,0 +1,75 @@
+import pygame
+
+SOLID = 1  # сквозь клетку нельзя пройти
+KILLING = 2  # клетка убивает игрока при касании
+
+
+def hitbox(mask):
+    """Прямоугольник вокруг непрозрачных пикселей маски (пустой, если их нет)"""
+    rects = mask.get_bounding_rects()
+    return rects[0].unionall(rects[1:]) if rects else pygame.Rect(0, 0, 0, 0)
+
+
+def touches(shape, rect, other):
+    """Касается ли форма shape, стоящая в rect, прямоугольника other
+
+    shape - None (весь rect), Rect (хитбокс относительно rect.topleft) или Mask (попиксельно,
+    только для тайлов, которым это явно задано в тайлсете)"""
+    if shape is None:
+        return rect.colliderect(other)
+    if isinstance(shape, pygame.Rect):
+        return shape.move(rect.topleft).colliderect(other)
+    clip = rect.clip(other)
+    if not clip:
+        return False
+    return shape.overlap(pygame.Mask(clip.size, fill=True), (clip.x - rect.x, clip.y - rect.y)) is not None
+
+
+class CollisionMap:
+    """Карта коллизий уровня
+
+    Вместо спрайта на каждый тайл хранит по байту флагов на клетку (SOLID, KILLING),
+    индекс клетки считается из координат арифметикой.
+
+    width, height - размер уровня в тайлах
+
+    tile_size - размер тайла в пикселях экрана"""
+
+    def __init__(self, width, height, tile_size):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.flags = bytearray(width * height)
+        self.shapes = {}  # (x, y) -> форма шипа (см. touches), чтобы убивать только по касанию хитбокса
+
+    def mark(self, x, y, flags, shape=None):
+        """Добавляет флаги клетке (x, y); shape - форма клетки, если она не вся клетка"""
+        self.flags[y * self.width + x] |= flags
+        if shape is not None:
+            self.shapes[(x, y)] = shape
+
+    def cells(self, rect):
+        """Координаты клеток уровня, которые задевает rect"""
+        size = self.tile_size
+        x1, y1 = max(rect.left // size, 0), max(rect.top // size, 0)
+        x2 = min((rect.right - 1) // size, self.width - 1)
+        y2 = min((rect.bottom - 1) // size, self.height - 1)
+        for y in range(y1, y2 + 1):
+            for x in range(x1, x2 + 1):
+                yield x, y
+
+    def cell_rect(self, x, y):
+        size = self.tile_size
+        return pygame.Rect(x * size, y * size, size, size)
+
+    def solid_rects(self, rect):
+        """Прямоугольники твёрдых клеток, пересекающихся с rect"""
+        return [self.cell_rect(x, y) for x, y in self.cells(rect) if self.flags[y * self.width + x] & SOLID]
+
+    def touches_killing(self, rect):
+        """Касается ли прямоугольник rect убивающей клетки"""
+        for x, y in self.cells(rect):
+            if self.flags[y * self.width + x] & KILLING:
+                if touches(self.shapes.get((x, y)), self.cell_rect(x, y), rect):
+                    return True
+        return False
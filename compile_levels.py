@@ -0,0 +1,83 @@
+"""Сборка уровней заранее
+
+Компилирует все levels/*.tmx (или перечисленные) под каждый нужный размер тайла
+в levels/.cache - то же самое, что игра делает сама при первой загрузке уровня
+(level_cache.compile_level): внешние тайлсеты разбираются, тайлы раскладываются
+чанками, свойства тайлов и объекты сохраняются таблицами, картинки масштабируются
+в атлас. После сборки игра при запуске читает только готовые файлы, XML не трогает.
+
+Уровни собираются параллельно в пуле процессов, по задаче на (уровень, размер тайла).
+Свежие файлы (TMX, тайлсеты и картинки не менялись) пропускаются.
+
+Размер тайла зависит от ширины экрана (см. sizes.tile_size), поэтому размеры
+задаются разрешениями (--screens) и/или прямо в пикселях (--tile-sizes).
+
+Запуск из корня репозитория:
+    python compile_levels.py
+    python compile_levels.py levels/level1.tmx --screens 1920x1080 --force"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import level_cache
+import sizes
+
+SCREENS = "1280x720,1366x768,1600x900,1920x1080,2560x1440,3840x2160"  # распространённые разрешения
+
+
+def compile_one(path, tile_size, force=False):
+    """Собирает один уровень под один размер тайла (в процессе пула)
+
+    Возвращает (путь, размер тайла, собран ли, секунд)"""
+    if not force and level_cache.is_compiled(path, tile_size):
+        return path, tile_size, False, 0.0
+    start = time.perf_counter()
+    level_cache.compile_level(path, tile_size)
+    return path, tile_size, True, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка уровней заранее")
+    parser.add_argument("levels", nargs="*", help="TMX-файлы, по умолчанию все levels/*.tmx")
+    parser.add_argument("--screens", default=SCREENS,
+                        help="разрешения экрана через запятую, под которые нужны уровни")
+    parser.add_argument("--tile-sizes", default="", help="дополнительные размеры тайла в пикселях через запятую")
+    parser.add_argument("--jobs", type=int, help="сколько процессов (по умолчанию - по числу ядер)")
+    parser.add_argument("--force", action="store_true", help="собрать заново даже свежие")
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(path) for path in args.levels]  # пути из командной строки - от текущей папки
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # уровни и картинки ищутся от корня
+    paths = paths or sorted(glob.glob(os.path.join("levels", "*.tmx")))
+    tile_sizes = {int(size) for size in args.tile_sizes.split(",") if size}
+    tile_sizes |= {sizes.tile_size(int(screen.lower().split("x")[0])) for screen in args.screens.split(",") if screen}
+    jobs = [(path, size) for path in paths for size in sorted(tile_sizes)]
+    print(f"Уровней: {len(paths)}, размеры тайла: {', '.join(map(str, sorted(tile_sizes)))}")
+
+    start = time.perf_counter()
+    compiled = skipped = failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(compile_one, path, size, args.force): (path, size) for path, size in jobs}
+        for future in as_completed(futures):
+            path, size = futures[future]
+            try:
+                _, _, done, seconds = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"  {path} @ {size}: ошибка: {error}")
+                continue
+            if done:
+                compiled += 1
+                print(f"  {path} @ {size}: {seconds:.2f} с")
+            else:
+                skipped += 1
+    print(f"Собрано {compiled}, свежих {skipped}, с ошибками {failed} за {time.perf_counter() - start:.2f} с")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import math
+
+import numpy as np
+import pygame
+
+
+def downsample(surface, factor):
+    """Уменьшает пиксельную картинку, увеличенную в factor раз, обратно до размера текстуры
+
+    Берётся пиксель из центра каждого увеличенного пикселя, поэтому при любом (и дробном)
+    factor получаются исходные пиксели без сдвигов и смешивания цветов"""
+    width, height = surface.get_size()
+    w, h = max(1, round(width / factor)), max(1, round(height / factor))
+    xs = np.minimum(((np.arange(w) + 0.5) * factor).astype(np.intp), width - 1)
+    ys = np.minimum(((np.arange(h) + 0.5) * factor).astype(np.intp), height - 1)
+    alpha = surface.get_flags() & pygame.SRCALPHA
+    result = pygame.Surface((w, h), pygame.SRCALPHA if alpha else 0)
+    pygame.surfarray.pixels3d(result)[...] = pygame.surfarray.pixels3d(surface)[xs][:, ys]
+    if alpha:
+        pygame.surfarray.pixels_alpha(result)[...] = pygame.surfarray.pixels_alpha(surface)[xs][:, ys]
+    return result
+
+
+class NativeFramebuffer:
+    """Кадр мира в разрешении текстур: 16 пикселей на тайл, а не 16 * factor
+
+    Мир (физика, rect) остаётся в пикселях экрана, меняется только отрисовка: картинки
+    спрайтов уменьшаются до размера текстур (один раз на картинку), кадр собирается на
+    маленькой поверхности и один раз за кадр увеличивается на экран без сглаживания.
+
+    screen_size - размер экрана в пикселях
+
+    factor - сколько пикселей экрана в пикселе текстуры (размер тайла / 16)"""
+
+    def __init__(self, screen_size, factor):
+        self.factor = factor
+        self.size = math.ceil(screen_size[0] / factor), math.ceil(screen_size[1] / factor)
+        self.surface = pygame.Surface(self.size)
+        self.images = {}  # картинка в масштабе экрана -> она же в масштабе текстур
+
+    def image(self, surface):
+        """Уменьшенная копия картинки спрайта (строится при первом обращении)"""
+        image = self.images.get(surface)
+        if image is None:
+            image = self.images[surface] = downsample(surface, self.factor)
+        return image
+
+    def clear(self):
+        """Забывает уменьшенные картинки (при смене уровня старые больше не нужны)"""
+        self.images = {}
+
+    def to_native(self, position):
+        """Мировые координаты в пикселях экрана -> в пикселях текстур"""
+        return pygame.math.Vector2(round(position[0] / self.factor), round(position[1] / self.factor))
+
+    def present(self, target):
+        """Увеличивает кадр на всю поверхность target без сглаживания"""
+        pygame.transform.scale(self.surface, target.get_size(), target)
@@ -0,0 +1,121 @@
+import collections
+
+import pygame
+
+
+class TextCache:
+    """Кэш отрисованных строк
+
+    Шрифт создаётся один раз на (файл, размер), строка рендерится один раз на
+    (текст, файл шрифта, размер, цвет). Когда строк больше capacity, выбрасываются
+    давно не нужные (LRU), так что меняющийся текст (координаты в отладке) не копится.
+
+    capacity - сколько строк держать"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.fonts = {}  # (файл, размер) -> Font
+        self.entries = collections.OrderedDict()  # ключ -> поверхность, от давно не нужных к свежим
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, size, name=None):
+        """Шрифт name (None - встроенный) размера size"""
+        key = name, size
+        font = self.fonts.get(key)
+        if font is None:
+            font = self.fonts[key] = pygame.font.Font(name, size)
+        return font
+
+    def render(self, text, size=30, color="black", name=None):
+        """Строка text, отрисованная шрифтом name размера size цветом color; рисовать на ней нельзя"""
+        key = text, name, size, tuple(pygame.Color(color))
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = self.entries[key] = self.font(size, name).render(text, 1, color)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return surface
+
+
+class Inventory:
+    """Собранные предметы: сколько каких и картинка для интерфейса
+
+    Меняется только в add (Item.on_collect); version растёт при каждом изменении,
+    по ней интерфейс понимает, что пора перерисоваться."""
+
+    def __init__(self):
+        self.counts = collections.Counter()  # имя предмета -> сколько собрано
+        self.icons = {}  # имя предмета -> картинка первого собранного
+        self.version = 0
+
+    def add(self, item):
+        self.counts[item.name] += 1
+        self.icons.setdefault(item.name, item.image)
+        self.version += 1
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+
+class InventoryHud:
+    """Слой интерфейса с инвентарём, который перерисовывается, только когда инвентарь меняется
+
+    text - TextCache для чисел"""
+
+    def __init__(self, text):
+        self.text = text
+        self.inventory = None
+        self.version = None
+        self.surface = None
+        self.rect = None  # где слой лежит на экране
+
+    def refresh(self, inventory):
+        """Собирает слой заново: по строке на предмет - картинка и сколько их"""
+        self.inventory = inventory
+        self.version = inventory.version
+        if not inventory.counts:
+            self.surface = self.rect = None
+            return
+        rows = []
+        for name, count in inventory.counts.items():
+            icon = inventory.icons[name]
+            text = self.text.render(str(count))
+            rows.append((icon, text, max(icon.get_height(), icon.get_height() // 2 + text.get_height())))
+        width = max(icon.get_width() + 10 + text.get_width() for icon, text, _ in rows)
+        height = sum(row_height for _, _, row_height in rows)
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        y = 0
+        for icon, text, row_height in rows:
+            self.surface.blit(icon, (0, y))
+            self.surface.blit(text, (icon.get_width() + 10, y + icon.get_height() // 2))
+            y += row_height
+        self.rect = self.surface.get_rect()
+
+    def prepare(self, inventory):
+        """Пересобирает слой, если инвентарь поменялся
+
+        Возвращает области экрана, где слой был и стал (их надо перерисовать), или пустой список"""
+        if inventory is self.inventory and inventory.version == self.version:
+            return []
+        old = self.rect
+        self.refresh(inventory)
+        return [rect for rect in (old, self.rect) if rect]
+
+    def draw(self, surface, inventory, rects=None):
+        """Рисует слой; rects - если экран перерисован не целиком, то только в этих областях"""
+        self.prepare(inventory)
+        if self.surface is None:
+            return
+        if rects is None:
+            surface.blit(self.surface, self.rect)
+            return
+        for rect in rects:
+            if rect.colliderect(self.rect):
+                surface.set_clip(rect)
+                surface.blit(self.surface, self.rect)
+        surface.set_clip(None)
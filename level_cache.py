@@ -0,0 +1,496 @@
+"""Скомпилированные уровни
+
+TMX-файл вместе с внешними тайлсетами (.tsx) и картинками один раз разбирается
+и сохраняется в бинарный файл в levels/.cache: тайлы слоёв чанками CHUNK_SIZE x CHUNK_SIZE,
+объекты, свойства тайлов и атлас картинок, уже отмасштабированных под размер тайла на экране.
+При следующих загрузках файл отображается в память (mmap) на всё время жизни уровня:
+XML и png не трогаются, заголовок читается сразу, а клетки чанков - по одному, когда до них
+доходит игрок (LevelData.read_chunks). Пересборка файла во время игры (os.replace) уже
+открытый уровень не задевает: отображение держит старый файл.
+Кэш пересобирается, если у TMX или любой его зависимости поменялись mtime или размер.
+Заранее все уровни под нужные размеры тайла собирает compile_levels.py.
+
+Бесконечные карты Tiled (infinite="1") при компиляции разворачиваются в прямоугольник
+по границам их чанков, в игре они ничем не отличаются от обычных."""
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import pygame
+import pytmx
+from pytmx.pytmx import unpack_gids
+from pytmx.util_pygame import handle_transformation
+
+MAGIC = b"PLVL"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sII")  # магия, версия, длина JSON-заголовка
+ATLAS_WIDTH = 2048  # ширина атласа в пикселях, тайлы раскладываются полками
+CHUNK_SIZE = 16  # сторона чанка в тайлах; пустые чанки в файл не пишутся
+
+
+class LevelLayer:
+    """Слой уровня: тайловый (chunks) или слой объектов (objects)
+
+    chunks - (cx, cy) -> смещение клеток непустого чанка в файле, сами клетки читает LevelData.read_chunks
+
+    gids - какие gid вообще встречаются в слое (чтобы знать заранее, что в нём есть)"""
+
+    def __init__(self, name, width, chunks=None, gids=None, objects=None):
+        self.name = name
+        self.width = width
+        self.chunks = chunks
+        self.gids = gids
+        self.objects = objects
+
+
+class LevelObject:
+    """Объект из слоя объектов Tiled (точка появления, телепорт и т.п.)"""
+
+    def __init__(self, type, name, x, y, width, height, gid, visible):
+        self.type = type
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.gid = gid
+        self.visible = visible
+
+    def __repr__(self):
+        return f'<LevelObject "{self.name}" ({self.type})>'
+
+
+class LevelData:
+    """Уровень в том виде, в каком он нужен игре
+
+    Читается из скомпилированного файла в любом потоке, а картинки превращаются
+    в поверхности методом finish(), который нужно звать из главного потока.
+
+    buffer - скомпилированный файл (mmap), из него дочитываются чанки, пока уровень не закрыт (close)
+
+    body - где в нём начинаются данные после заголовка"""
+
+    def __init__(self, path, header, buffer, body=0):
+        self.path = path
+        self.buffer = buffer
+        self.body = body
+        self.width = header["width"]
+        self.height = header["height"]
+        self.tilewidth = header["tilewidth"]
+        self.tile_size = header["tile_size"]
+        self.chunk_size = header["chunk_size"]
+        self.properties = {int(gid): props for gid, props in header["properties"].items()}
+        self.layers = []
+        self.objects = []
+        for layer in header["layers"]:
+            if layer["kind"] == "tiles":
+                chunks = {(cx, cy): offset for cx, cy, offset in layer["chunks"]}
+                self.layers.append(LevelLayer(layer["name"], self.width, chunks=chunks, gids=set(layer["gids"])))
+            else:
+                objects = [LevelObject(**obj) for obj in layer["objects"]]
+                self.objects += objects
+                self.layers.append(LevelLayer(layer["name"], self.width, objects=objects))
+        atlas = header["atlas"]
+        start = body + atlas["offset"]
+        self.atlas_size = tuple(atlas["size"])
+        self.atlas_bytes = bytes(buffer[start:start + atlas["size"][0] * atlas["size"][1] * 4])
+        self.atlas_tiles = atlas["tiles"]
+        self.images = {}  # (gid, (w, h)) -> поверхность, заполняется в finish()
+        self.atlas = None  # поверхность атласа, на которую ссылаются images
+
+    def finish(self):
+        """Переводит атлас в формат экрана и режет его на тайлы (только в главном потоке)"""
+        if self.atlas_bytes is not None:
+            atlas = self.atlas = pygame.image.frombuffer(self.atlas_bytes, self.atlas_size, "RGBA").convert_alpha()
+            for gid, w, h, x, y in self.atlas_tiles:
+                self.images[(gid, (w, h))] = atlas.subsurface((x, y, w, h))
+            self.atlas_bytes = None
+        return self
+
+    def tile_image(self, gid, size):
+        """Готовая картинка тайла нужного размера или None"""
+        return self.images.get((gid, tuple(size)))
+
+    def tile_properties(self, gid):
+        return self.properties.get(gid)
+
+    def read_chunks(self, cx, cy, indices=None):
+        """Клетки чанка (cx, cy): индекс слоя -> array с gid по строкам (chunk_size x chunk_size)
+
+        indices - из каких слоёв читать (по умолчанию из всех); слои, где чанк пустой, в ответ не попадают.
+        Клетки за краем уровня - нули. Можно звать из любого потока, пока уровень не закрыт."""
+        if indices is None:
+            indices = range(len(self.layers))
+        wanted = [(index, self.layers[index].chunks.get((cx, cy))) for index in indices
+                  if self.layers[index].chunks is not None]
+        wanted = [(index, offset) for index, offset in wanted if offset is not None]
+        result = {}
+        if not wanted:
+            return result
+        length = self.chunk_size * self.chunk_size * array("I").itemsize
+        for index, offset in wanted:
+            start = self.body + offset
+            tiles = array("I")
+            tiles.frombytes(self.buffer[start:start + length])
+            result[index] = tiles
+        return result
+
+    def close(self):
+        """Отпускает файл уровня; после этого чанки больше не читаются"""
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+
+def cache_path(path, tile_size):
+    """Путь к скомпилированному файлу уровня для данного размера тайла"""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, ".cache", f"{os.path.splitext(name)[0]}-{tile_size}.lvl")
+
+
+def level_sources(path):
+    """Все файлы, от которых зависит уровень: сам TMX, внешние тайлсеты и картинки"""
+    sources = [path]
+    folder = os.path.dirname(path)
+    root = ElementTree.parse(path).getroot()
+    for node in root.iter():
+        source = node.get("source")
+        if node.tag not in ("tileset", "image") or not source:
+            continue
+        source = os.path.normpath(os.path.join(folder, source))
+        sources.append(source)
+        if node.tag == "tileset":
+            tsx_folder = os.path.dirname(source)
+            for image in ElementTree.parse(source).getroot().iter("image"):
+                sources.append(os.path.normpath(os.path.join(tsx_folder, image.get("source"))))
+    return sources
+
+
+def stamp(sources):
+    """Отпечаток файлов для проверки актуальности кэша: mtime и размер каждого"""
+    stamps = {}
+    for source in sources:
+        info = os.stat(source)
+        stamps[source] = [info.st_mtime_ns, info.st_size]
+    return stamps
+
+
+def raw_image_loader(filename, colorkey, **kwargs):
+    """Загрузчик картинок для pytmx без convert(), поэтому работает без окна и в любом потоке"""
+    image = pygame.image.load(filename)
+    if colorkey:
+        image.set_colorkey(pygame.Color(f"#{colorkey}"))
+
+    def load_image(rect=None, flags=None):
+        tile = image.subsurface(rect) if rect else image
+        if flags:
+            tile = handle_transformation(tile, flags)
+        # переносим в поверхность с альфа-каналом, прозрачный цвет тайлсета становится прозрачностью
+        surface = pygame.Surface(tile.get_size(), pygame.SRCALPHA, 32)
+        surface.blit(tile, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        return surface
+
+    return load_image
+
+
+def flatten_infinite(root):
+    """Разворачивает бесконечную карту (слои из чанков) в обычную, которую понимает pytmx
+
+    Границы карты - общий прямоугольник всех чанков всех слоёв, его левый верхний угол
+    становится клеткой (0, 0); объекты сдвигаются вместе с тайлами. Клетки пишутся
+    в CSV по строкам, как у конечной карты, поэтому pytmx нумерует gid так же."""
+    layers = []
+    for layer in root.iter("layer"):
+        data = layer.find("data")
+        chunks = []
+        for chunk in data.findall("chunk"):
+            x, y = int(chunk.get("x")), int(chunk.get("y"))
+            width, height = int(chunk.get("width")), int(chunk.get("height"))
+            gids = unpack_gids(chunk.text.strip(), data.get("encoding"), data.get("compression"))
+            chunks.append((x, y, width, height, gids))
+            data.remove(chunk)
+        layers.append((layer, data, chunks))
+    bounds = [chunk[:4] for _, _, chunks in layers for chunk in chunks]
+    if bounds:
+        left = min(x for x, _, _, _ in bounds)
+        top = min(y for _, y, _, _ in bounds)
+        width = max(x + w for x, _, w, _ in bounds) - left
+        height = max(y + h for _, y, _, h in bounds) - top
+    else:
+        left = top = width = height = 0
+    for layer, data, chunks in layers:
+        tiles = array("I", bytes(width * height * 4))
+        for x, y, w, h, gids in chunks:
+            for row in range(h):
+                start = (y - top + row) * width + x - left
+                tiles[start:start + w] = array("I", gids[row * w:row * w + w])
+        layer.set("width", str(width))
+        layer.set("height", str(height))
+        data.attrib.pop("compression", None)
+        data.set("encoding", "csv")
+        data.text = ",".join(map(str, tiles)) if tiles else "0"
+    tilewidth, tileheight = int(root.get("tilewidth")), int(root.get("tileheight"))
+    for obj in root.iter("object"):
+        obj.set("x", str(float(obj.get("x", 0)) - left * tilewidth))
+        obj.set("y", str(float(obj.get("y", 0)) - top * tileheight))
+    root.set("width", str(width))
+    root.set("height", str(height))
+    root.set("infinite", "0")
+
+
+def split_chunks(data, width, height):
+    """Режет клетки слоя (строки gid, как layer.data у pytmx) на непустые чанки: (cx, cy) -> array"""
+    chunks = {}
+    for cy in range(math.ceil(height / CHUNK_SIZE)):
+        rows = data[cy * CHUNK_SIZE:(cy + 1) * CHUNK_SIZE]
+        for cx in range(math.ceil(width / CHUNK_SIZE)):
+            x = cx * CHUNK_SIZE
+            cells = [row[x:x + CHUNK_SIZE] for row in rows]
+            if not any(any(row) for row in cells):
+                continue
+            tiles = array("I", bytes(CHUNK_SIZE * CHUNK_SIZE * 4))
+            for y, row in enumerate(cells):
+                tiles[y * CHUNK_SIZE:y * CHUNK_SIZE + len(row)] = array("I", row)
+            chunks[(cx, cy)] = tiles
+    return chunks
+
+
+def compile_level(path, tile_size, target=None):
+    """Разбирает TMX и пишет скомпилированный уровень; возвращает путь к файлу"""
+    target = target or cache_path(path, tile_size)
+    sources = level_sources(path)
+    root = ElementTree.parse(path).getroot()
+    if root.get("infinite") == "1":
+        flatten_infinite(root)
+    level = pytmx.TiledMap(image_loader=raw_image_loader)
+    level.filename = path  # внешние тайлсеты и картинки ищутся рядом с TMX
+    level.parse_xml(root)
+
+    def scaled_size(width, height):
+        return round(width / level.tilewidth * tile_size), round(height / level.tilewidth * tile_size)
+
+    # какие картинки и каких размеров понадобятся игре
+    wanted = {(gid, (tile_size, tile_size)) for gid, image in enumerate(level.images) if image}
+    layers = []
+    for layer in level.visible_layers:
+        if isinstance(layer, pytmx.TiledTileLayer):
+            layers.append(("tiles", layer.name, split_chunks(layer.data, level.width, level.height)))
+        elif isinstance(layer, pytmx.TiledObjectGroup):
+            objects = []
+            for obj in layer:
+                gid = obj.gid or 0
+                if gid and level.images[gid]:
+                    wanted.add((gid, scaled_size(obj.width, obj.height)))
+                objects.append({"type": obj.type, "name": obj.name, "x": obj.x, "y": obj.y,
+                                "width": obj.width, "height": obj.height, "gid": gid,
+                                "visible": bool(obj.visible)})
+            layers.append(("objects", layer.name, objects))
+
+    # раскладываем картинки полками: слева направо, пока влезает по ширине
+    placed = []
+    x = y = row_height = 0
+    for gid, (w, h) in sorted(wanted, key=lambda item: (item[1][1], item[0])):
+        if x + w > ATLAS_WIDTH:
+            x, y, row_height = 0, y + row_height, 0
+        placed.append((gid, w, h, x, y))
+        x += w
+        row_height = max(row_height, h)
+    atlas = pygame.Surface((ATLAS_WIDTH, max(y + row_height, 1)), pygame.SRCALPHA, 32)
+    for gid, w, h, x, y in placed:
+        image = pygame.transform.scale(level.images[gid], (w, h))
+        atlas.blit(image, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+
+    properties = {}
+    for gid in range(len(level.images)):
+        props = level.get_tile_properties_by_gid(gid)
+        if props:
+            # в файл идут только простые значения, остальное игре не нужно
+            properties[gid] = {key: value for key, value in props.items()
+                               if isinstance(value, (str, int, float, bool))}
+
+    header = {"tile_size": tile_size, "byteorder": sys.byteorder, "sources": stamp(sources),
+              "chunk_size": CHUNK_SIZE, "width": level.width, "height": level.height,
+              "tilewidth": level.tilewidth, "properties": properties, "layers": [], "atlas": {}}
+    parts = []  # куски файла после заголовка
+    offset = 0
+    for kind, name, payload in layers:
+        if kind == "tiles":
+            placement = []
+            gids = set()
+            for (cx, cy), tiles in payload.items():
+                placement.append([cx, cy, offset])
+                gids.update(tiles)
+                data = tiles.tobytes()
+                parts.append(data)
+                offset += len(data)
+            gids.discard(0)
+            header["layers"].append({"kind": kind, "name": name, "chunks": placement, "gids": sorted(gids)})
+        else:
+            header["layers"].append({"kind": kind, "name": name, "objects": payload})
+    atlas_data = pygame.image.tobytes(atlas, "RGBA")
+    header["atlas"] = {"offset": offset, "size": list(atlas.get_size()), "tiles": placed}
+    parts.append(atlas_data)
+
+    header_data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(header_data)))
+        file.write(header_data)
+        for part in parts:
+            file.write(part)
+    os.replace(temp, target)  # атомарно: читатель не увидит недописанный файл
+    return target
+
+
+def read_header(file, path, tile_size):
+    """Заголовок скомпилированного файла, если он подходит уровню path и размеру тайла, иначе None
+
+    Файл остаётся на начале данных. Если самого TMX нет (в сборку положили только
+    скомпилированные уровни), файл считается свежим."""
+    magic, version, header_length = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    header = json.loads(file.read(header_length).decode("utf-8"))
+    if header["byteorder"] != sys.byteorder or header["tile_size"] != tile_size:
+        return None
+    if os.path.exists(path) and header["sources"] != stamp(header["sources"]):
+        return None
+    return header
+
+
+def is_compiled(path, tile_size):
+    """Есть ли у уровня свежий скомпилированный файл (читается только заголовок)"""
+    try:
+        with open(cache_path(path, tile_size), "rb") as file:
+            return read_header(file, path, tile_size) is not None
+    except (OSError, ValueError, KeyError, struct.error):
+        return False
+
+
+def read_compiled(path, tile_size):
+    """Читает скомпилированный уровень через mmap; None, если файла нет или он устарел
+
+    Файл остаётся отображённым в память, пока уровень не закроют (LevelData.close).
+    Не создаёт поверхностей, поэтому можно звать из рабочего потока."""
+    target = cache_path(path, tile_size)
+    try:
+        with open(target, "rb") as file:
+            header = read_header(file, path, tile_size)
+            if header is None:
+                return None
+            start = file.tell()
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # живёт и после закрытия file
+        try:
+            return LevelData(path, header, mapped, start)
+        except Exception:
+            mapped.close()
+            raise
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+
+def load_level_data(path, tile_size):
+    """Данные уровня без поверхностей: из кэша, а если его нет - компилирует TMX"""
+    data = read_compiled(path, tile_size)
+    if data is None:
+        compile_level(path, tile_size)
+        data = read_compiled(path, tile_size)
+    return data
+
+
+def load_level(path, tile_size):
+    """Готовый к игре уровень (зовётся из главного потока)"""
+    return load_level_data(path, tile_size).finish()
+
+
+class LevelLoader:
+    """Фоновая загрузка уровней
+
+    Если кэша нет или он устарел, уровень компилируется в отдельном процессе (как в
+    compile_levels.py): compile_level разбирает XML, грузит и масштабирует картинки через pygame,
+    и в потоках игры этого делать нельзя. Готовый кэш читается в пуле потоков (read_compiled).
+    Главному потоку остаётся только finish(): poll() доделывает прочитанные уровни по одному
+    за кадр, а get() отдаёт уровень сразу, если он уже подготовлен.
+
+    workers - сколько уровней готовится одновременно"""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="level-loader")
+        self.compiler = None  # пул процессов для компиляции, создаётся при первой надобности
+        self.pending = {}  # (путь, размер тайла) -> Future с LevelData без поверхностей
+        self.ready = {}  # (путь, размер тайла) -> готовый к игре LevelData
+
+    def preload(self, path, tile_size):
+        """Начинает готовить уровень в фоне (повторные вызовы ничего не делают)"""
+        key = path, tile_size
+        if key in self.pending or key in self.ready:
+            return
+        if os.path.exists(path) or os.path.exists(cache_path(path, tile_size)):
+            self.pending[key] = self.executor.submit(self.prepare, path, tile_size)
+
+    def prepare(self, path, tile_size):
+        """Данные уровня без поверхностей (в потоке пула): кэш, при необходимости собранный в процессе"""
+        data = read_compiled(path, tile_size)
+        if data is None:
+            self.compile(path, tile_size).result()  # поток ждёт процесс, главный поток не ждёт никого
+            data = read_compiled(path, tile_size)
+            if data is None:
+                raise OSError(f"compiled level {cache_path(path, tile_size)} is not readable")
+        return data
+
+    def compile(self, path, tile_size):
+        """Future компиляции уровня в пуле процессов"""
+        if self.compiler is None:
+            # spawn, а не fork: в игре уже работают потоки и SDL, копировать их в процесс нельзя
+            self.compiler = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return self.compiler.submit(compile_level, path, tile_size)
+
+    def retain(self, paths):
+        """Забывает (и закрывает) подготовленные уровни, кроме перечисленных"""
+        for key in list(self.ready):
+            if key[0] not in paths:
+                self.ready.pop(key).close()
+
+    def poll(self):
+        """Доделывает в главном потоке один уровень, который успел прочитаться в фоне"""
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                try:
+                    self.ready[key] = future.result().finish()
+                except Exception as error:
+                    print(f"Cannot preload level {key[0]}: {error}")
+                return
+
+    def get(self, path, tile_size):
+        """Готовый уровень: подготовленный заранее, дождавшийся фоновой загрузки или загруженный сейчас"""
+        key = path, tile_size
+        if key in self.ready:
+            return self.ready.pop(key)
+        future = self.pending.pop(key, None)
+        if future is not None:
+            try:
+                return future.result().finish()
+            except Exception as error:
+                print(f"Cannot preload level {path}: {error}")
+        return load_level(path, tile_size)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.compiler is not None:
+            self.compiler.shutdown(wait=True, cancel_futures=True)
+            self.compiler = None
+        for data in self.ready.values():
+            data.close()
+        self.ready.clear()
@@ -1,90 +1,173 @@
+import argparse
 import time
 
+import numpy as np
 import pygame
 import os
 
-import pytmx.pytmx
-from pytmx.util_pygame import load_pygame
-
 import random
 
+import animation
+import assets
+import background
+import framebuffer
+import hud
+import level_cache
+import profiler
+import replay
+from collision import CollisionMap, SOLID, KILLING, hitbox, touches
+from sizes import PLAYER_IMAGE, player_size, screen_scale
+from spatial import SpatialGroup
+from swarm import Swarm
+from triggers import TriggerRegistry
+
+TICK_RATE = 60  # тиков физики в секунду; GRAVITY, JUMP_V и прочие скорости заданы на один тик
+MAX_TICKS = 5  # больше тиков за кадр не считаем, чтобы медленная машина не ушла в спираль догоняния
 SCALE = 400  # масштаб игры (1 - виден весь уровень, 5 - виден игрок и по 7-8 тайлов влево и вправо)
 GRAVITY = 0.2  # константа графитации
 JUMP_V = 2.3  # скорость прыжка
 WALK_V = 2  # скорость ходьбы
 SPRINT_V = 4  # скорость бега
 V_MAX = 100  # ограничение скорости
+CHUNK_SIZE = level_cache.CHUNK_SIZE  # сторона чанка в тайлах, так уровень лежит в скомпилированном файле
+ACTIVE_MARGIN = 8  # на сколько тайлов за краем экрана объекты ещё обновляются
+DIRTY_MAX_RECTS = 32  # если за кадр поменялось больше областей (или больше пол-экрана), экран рисуется целиком
 
-PLAYER_IMAGE = 'no anim2.png'
-PLAYER_IDLE = ('no move anim.png', 4, 6)
-PLAYER_RUN = ('run2.png', 6, 30)
-PLAYER_WALK = ('walk2.png', 6, 15)
+BACKGROUND = 'background.json'  # слои фона: картинка, скорость параллакса и высота в экранах
+PLAYER_ANIMATIONS = 'player_animations.json'  # анимации игрока: лист, число кадров и скорость каждой
 
+ASSET_BUDGET = 256 * 1024 * 1024  # сколько байт картинок держать в кэше, прежде чем выбрасывать старые
 COINS_MAGNET = pygame.USEREVENT + 1
 coins = []
 
+HEADLESS_SIZE = (1920, 1080)  # разрешение экрана в памяти, если запускаемся без окна
+
 FADE_OUT = 0
-CURRENT_LEVEL = None
+CURRENT_LEVEL = "level1.tmx"
 teleport = None
 
+# всё ниже создаётся в init_game
+screen = None
+pxs_in_1px = 1  # сколько пикселей экрана в одном пикселе текстуры
+vsync_enabled = False  # flip действительно ждёт обновления экрана (тогда clock.tick не ограничивает FPS)
+color_cor = None  # поверхность затемнения
+color_cor_func = None  # чем заливается затемнение (чёрный экран или экран смерти)
+fade_overlays = {}  # color_cor_func -> готовая поверхность затемнения
+fade_drawn = 0  # FADE_OUT, с которым рисовался прошлый кадр (0 - без затемнения)
+debug_drawn = False  # был ли в прошлом кадре отладочный текст
+clock = None
+all_sprites = None  # группа всех спрайтов, что движимы камерой
+player_group = None
+collide_tiles = None
+killing_group = None
+triggers = None  # реестр объектов, которые реагируют на касание и кнопку E
+swarm = None  # монеты и предметы, которые летят к игроку
+collision_map = None  # карта коллизий текущего уровня, создаётся в gen_level
+level_snapshot = None  # начальное состояние текущего уровня для быстрого перезапуска
+level_streamer = None  # подгрузка текущего уровня чанками вокруг камеры
+level_loader = None  # фоновая подготовка уровней, куда ведут телепорты
+player = None
+level = None
+level_scale = None
+
+running = True
+dt = 0  # что это воще
+debug_text = []
+DEBUG_MODE = False
+NATIVE_RENDER = False  # собирать кадр мира в разрешении текстур и увеличивать его один раз (--native)
 
-def load_image(name):
-    """Загружает изображение
+input_recorder = None  # replay.InputRecorder, если ввод записывается
+input_replay = None  # replay.InputReplay, если ввод берётся из записи
 
-    Возвращает кортеж с изображением и прямоугольником"""
-    fullname = os.path.join("data", name)
-    try:
-        image = pygame.image.load(fullname)
-        if image.get_alpha is None:
-            image = image.convert()
-        else:
-            image = image.convert_alpha()
-    except FileNotFoundError:
-        print(f"Cannot load image: {fullname}")
-        raise SystemExit
+asset_manager = assets.AssetManager("data", ASSET_BUDGET)  # все картинки из data, по разу на процесс
+level_assets = []  # ключи ассетов текущего уровня, закреплённые в asset_manager
+text_cache = hud.TextCache()  # строки интерфейса и подсказок рендерятся по разу
+inventory_hud = hud.InventoryHud(text_cache)
+
+# части кадра для замеров, в порядке выполнения (wait - ожидание в clock.tick, не работа)
+FRAME_PHASES = ("events", "loader", "update", "draw", "hud", "fade", "flip", "wait")
+frame_profiler = profiler.FrameProfiler(FRAME_PHASES, idle=("wait",))
+
+
+def load_image(name, size=None):
+    """Загружает изображение (из кэша, с диска - только первый раз)
+
+    size - (w, h), если нужна отмасштабированная копия
+
+    Возвращает кортеж с изображением и прямоугольником. Изображение общее, рисовать на нём нельзя"""
+    image = asset_manager.image(name, size)
     return image, image.get_rect()
 
 
+def pin_level_assets(keys):
+    """Закрепляет ассеты нового уровня и отпускает ассеты прошлого"""
+    global level_assets
+    for key in keys:
+        asset_manager.pin(key)
+    for key in level_assets:
+        asset_manager.unpin(key)
+    level_assets = list(keys)
+
+
 def gen_level(name):
-    """Создаёт экземпляры класса Tile
+    """Готовит уровень: статичные слои, карту коллизий и подгрузку чанков (см. LevelStreamer)
+
+        Предметы и сундуки создаются, когда до их чанка доходит камера, телепорты - сразу.
 
         Возвращает кортеж с загруженным уровнем и размером тайла в пикселях """
-    level = load_pygame(name)  # получаем уровень
+    global collision_map
+    global level_snapshot
+    global level_streamer
     scale = player.rect.width  # высота(ширина) тайла - пол высоты игрока
+    level = level_loader.get(name, scale)  # получаем уровень (подготовленный в фоне или из кэша)
+    atlas_key = "level", name, scale
+    pin_level_assets([atlas_key])  # закрепляем до put, иначе большой атлас сразу вылетит из бюджета
+    if level.atlas is not None:
+        asset_manager.put(atlas_key, level.atlas)  # чтобы атлас считался в бюджете
+    tile_cache = TileCache(level)  # одинаковые тайлы делят одну картинку и одну маску
     tile_width = level.tilewidth  # сколько пикселей тайл в ширину(высоту)
-    for layer in level.visible_layers:
+    collide_tiles.set_cell_size(scale)  # ячейка сетки коллизий - один тайл
+    triggers.set_cell_size(scale * 2)  # зона использования - пара тайлов вокруг игрока
+    all_sprites.set_cell_size(scale * CHUNK_SIZE)  # активных объектов мало, ячейки крупные
+    all_sprites.active_margin = ACTIVE_MARGIN * scale
+    if NATIVE_RENDER:
+        all_sprites.set_native(scale / tile_width)
+    collision_map = CollisionMap(level.width, level.height, scale)
+    level_streamer = LevelStreamer(level, tile_cache, scale)
+    # клетки читаются чанками по мере того, как до них доходит камера, а здесь по списку gid
+    # каждого слоя решается, что из него запекается в TileLayer и где в порядке отрисовки его спрайты
+    static_layer = None  # TileLayer, в который ещё можно дописывать слои
+    for index, layer in enumerate(level.layers):
         if layer.name == "player":
             player.add(all_sprites)
-        if isinstance(layer, pytmx.pytmx.TiledTileLayer):
-            for x, y, gid in layer:
-                image_tile = level.get_tile_image_by_gid(gid)
-                if image_tile:
-                    image_tile = pygame.transform.scale(image_tile, [scale, scale])
-                    tile_args = image_tile, (x * scale, y * scale)
-                    tile = Tile(*tile_args)
-                    if layer.name == "collide":
-                        tile.solid = True
-                    if layer.name == "items":
-                        tile = Item(*tile_args)
-                        if level.get_tile_properties_by_gid(gid):
-                            if level.get_tile_properties_by_gid(gid)["type"] == "coin":
-                                tile = Coin(*tile_args)
-                                tile.name = "coin"
-                            # if level.get_tile_properties_by_gid(gid)["type"] == "key":
-                            #     tile = Coin(*tile_args)
-                            #     tile.name = "coin"
-                    if level.get_tile_properties_by_gid(gid):
-                        if level.get_tile_properties_by_gid(gid)["type"] == "spike":
-                            tile.killing = True
-                        if level.get_tile_properties_by_gid(gid)["type"] == "chest":
-                            tile = Chest(*tile_args)
-                            img = level.images[1].convert_alpha()
-                            tile.opened_image = pygame.transform.scale(img, [scale, scale])
-                            tile.name = "chest"
-                            tile.can_use = True
-                            img = level.images[2]
-                            tile.coin_image = pygame.transform.scale(img, [scale, scale])
-                    tile.add(all_sprites)
+            static_layer = None
+        if layer.chunks is None:
+            continue
+        static_images = {}
+        has_sprites = False
+        for gid in layer.gids:
+            image_tile = tile_cache.image(gid, (scale, scale))
+            if image_tile:
+                properties = tile_cache.properties(gid)
+                tile_type = properties.get("type") if properties else None
+                if layer.name != "items" and tile_type != "chest":
+                    static_images[gid] = image_tile  # обычный тайл ничего не делает, ему хватит клетки в чанке
+                else:
+                    has_sprites = True
+        if not static_images and not has_sprites:
+            continue
+        # подряд идущие слои без спрайтов между ними запекаются в одни и те же чанки,
+        # а спрайты слоя идут после его статичных тайлов, так порядок отрисовки не меняется
+        if static_images:
+            if static_layer is None:
+                static_layer = TileLayer(level, scale)
+                static_layer.add(all_sprites)
+            static_layer.add_source(index, static_images)
+        order = None
+        if has_sprites:
+            order = all_sprites.reserve(level.width * level.height)  # место под спрайты слоя, по клетке на каждую
+            static_layer = None
+        level_streamer.add_layer(index, order)
     for obj in level.objects:
         # print(obj.x, obj.y)
         if obj.visible:
@@ -95,80 +178,447 @@ def gen_level(name):
                 print("init TLEPORT", obj)
                 x = obj.x / tile_width * scale
                 y = obj.y / tile_width * scale
-                img = pygame.transform.scale(obj.image, [scale, scale * 2])
-                t = Teleport(img, (x, y), dest=obj.name)
+                size = round(obj.width / tile_width * scale), round(obj.height / tile_width * scale)
+                img = tile_cache.image(obj.gid, size)
+                t = Teleport(img, (x, y), dest=obj.name, shape=tile_cache.shape(obj.gid, size))
                 t.can_use = True
                 t.add(all_sprites)
                 print(t)
     all_sprites.level = level  # сообщаем группе об уровне
+    # уровни, куда ведут телепорты, готовятся в фоне, пока игрок до них идёт
+    destinations = [os.path.join(os.path.dirname(name), sprite.dest) for sprite in all_sprites
+                    if isinstance(sprite, Teleport) and sprite.dest_level]
+    level_loader.retain(destinations)
+    for path in destinations:
+        level_loader.preload(path, scale)
+    # имя - как его получает restart: путь относительно levels, в том числе из подпапок
+    level_snapshot = LevelSnapshot(os.path.relpath(name, "levels"), all_sprites, player)  # запоминаем уровень как был
+    level_streamer.load_around(player)  # то, что видно сразу
     return level, scale
 
 
 def restart(level_name, save_money=True):
-    global player
     global level
     global level_scale
-    money = []
+    money = hud.Inventory()
     if save_money:
         money = player.items
+    coins.clear()
+    all_sprites.previous.clear()  # объекты перескочат на место, без интерполяции
+
+    if level_snapshot and level_snapshot.name == os.path.normpath(level_name):
+        # тот же уровень: откатываем изменившиеся объекты, ничего не загружая
+        level_snapshot.restore(all_sprites, player)
+        player.items = money
+        player.add(player_group)
+        return
 
     for sprite in all_sprites.sprites():
+        if isinstance(sprite, TileLayer):
+            sprite.release()
         sprite.kill()
     all_sprites.empty()
     player.kill()
-    del player
-    player = Player((0, 0))
-    if save_money:
-        player.items = money
+    player.reset((0, 0))
+    player.items = money
     player.add(player_group)
+    if level:
+        level.close()  # старый уровень больше не читается, отпускаем его файл
     level, level_scale = gen_level(f"levels/{level_name}")
 
     # player.add(all_sprites)
 
 
+class LevelSnapshot:
+    """Начальное состояние загруженного уровня
+
+    Запоминает состояние каждого объекта, его место в порядке отрисовки и точку появления
+    игрока. restore() возвращает к нему только то, что изменилось, и убирает всё,
+    что появилось после загрузки (например, монеты из сундуков).
+
+    name - путь к файлу уровня относительно levels (как его получает restart)
+
+    group - группа всех спрайтов уровня"""
+
+    def __init__(self, name, group, player):
+        self.name = name
+        self.spawn = player.rect.topleft
+        self.order = {sprite: group.order[sprite] for sprite in group}
+        self.states = {sprite: sprite.get_state() for sprite in group if isinstance(sprite, Tile)}
+
+    def remember(self, group, sprites):
+        """Запоминает начальное состояние спрайтов, которые подгрузились уже после загрузки уровня"""
+        for sprite in sprites:
+            self.order[sprite] = group.order[sprite]
+            if isinstance(sprite, Tile):
+                self.states[sprite] = sprite.get_state()
+
+    def restore(self, group, player):
+        for sprite in group.sprites():
+            if sprite not in self.order:
+                sprite.kill()
+        for sprite, state in self.states.items():
+            if sprite.alive() and sprite.get_state() == state:
+                continue  # не менялся
+            sprite.set_state(state)
+            if sprite.alive():
+                group.unpin(sprite)
+                group.move(sprite)
+            else:
+                group.reinsert(sprite, self.order[sprite])
+        player.reset(self.spawn)
+        if player in self.order:
+            group.reinsert(player, self.order[player])
+
+
+class TileCache:
+    """Кэш картинок, форм для столкновений и свойств тайлов уровня
+
+    Картинки уже отмасштабированы в скомпилированном уровне, а форма считается
+    один раз на gid и размер, после чего её делят все клетки и спрайты с этим gid.
+
+    Форма задаётся свойством тайла collision в тайлсете: "rect" - весь тайл,
+    "mask" - попиксельная маска, по умолчанию - хитбокс вокруг непрозрачных пикселей.
+
+    level - загруженный уровень (level_cache.LevelData)"""
+
+    def __init__(self, level):
+        self.level = level
+        self.shapes = {}  # (gid, размер) -> форма (см. collision.touches)
+        self.props = {}  # gid -> свойства тайла
+
+    def image(self, gid, size):
+        return self.level.tile_image(gid, size)
+
+    def shape(self, gid, size):
+        key = gid, size
+        if key not in self.shapes:
+            properties = self.properties(gid) or {}
+            kind = properties.get("collision")
+            if kind == "rect":
+                self.shapes[key] = None
+            else:
+                mask = pygame.mask.from_surface(self.image(gid, size))
+                self.shapes[key] = mask if kind == "mask" else hitbox(mask)
+        return self.shapes[key]
+
+    def properties(self, gid):
+        if gid not in self.props:
+            self.props[gid] = self.level.tile_properties(gid)
+        return self.props[gid]
+
+
+class TileLayer(pygame.sprite.Sprite):
+    """Статичные слои тайлов, запечённые в чанки
+
+    Не создаёт спрайт на каждую клетку и не держит клетки в памяти: когда чанк впервые
+    попадает в камеру, его клетки читаются из скомпилированного уровня (level.read_chunks)
+    и склеиваются в поверхность CHUNK_SIZE x CHUNK_SIZE тайлов. Готовые чанки лежат
+    в asset_manager, поэтому далёкие выбрасываются вместе с прочими картинками, когда кэш
+    выходит за бюджет, и запекаются заново, если камера к ним вернётся. За кадр рисуются
+    только чанки, попавшие в камеру.
+
+    level - загруженный уровень (level_cache.LevelData)
+
+    tile_size - размер тайла в пикселях"""
+
+    always_active = True  # видимые чанки отбираются в draw
+
+    def __init__(self, level, tile_size):
+        pygame.sprite.Sprite.__init__(self)
+        self.level = level
+        self.width = level.width
+        self.height = level.height
+        self.tile_size = tile_size
+        self.chunk_px = CHUNK_SIZE * tile_size  # сторона чанка в пикселях
+        self.sources = []  # (индекс слоя в level.layers, {gid: картинка}) снизу вверх
+        self.filled = set()  # чанки, в которых у слоёв есть хоть одна клетка
+        self.empty = set()  # из них те, где не нашлось ни одного статичного тайла
+        self.baked = set()  # ключи запечённых чанков в asset_manager
+        self.visible = set()  # ключи чанков на экране, они закреплены в asset_manager
+        self.image = None
+        self.rect = pygame.Rect(0, 0, self.width * tile_size, self.height * tile_size)
+
+    def add_source(self, index, images):
+        """Добавляет слой уровня поверх уже добавленных; рисуются только клетки с gid из images"""
+        self.sources.append((index, images))
+        self.filled.update(self.level.layers[index].chunks)
+
+    def make_chunk(self, cx, cy, size):
+        # крайние чанки обрезаются по границе уровня
+        w = min(CHUNK_SIZE, self.width - cx * CHUNK_SIZE) * size
+        h = min(CHUNK_SIZE, self.height - cy * CHUNK_SIZE) * size
+        return pygame.Surface((w, h), pygame.SRCALPHA)
+
+    def chunk_key(self, cx, cy, native=None):
+        """Ключ чанка в asset_manager"""
+        return "chunk", self.level.path, self.tile_size, self.sources[0][0], cx, cy, native is not None
+
+    def get_chunk(self, cx, cy, native=None):
+        """Запечённый чанк или None, если он пустой
+
+        native - framebuffer.NativeFramebuffer, если нужен чанк в масштабе текстур"""
+        if (cx, cy) not in self.filled or (cx, cy) in self.empty:
+            return None
+        key = self.chunk_key(cx, cy, native)
+        chunk = asset_manager.get(key)
+        if chunk is None:
+            chunk = self.bake_chunk(cx, cy, native)
+            if chunk is None:
+                self.empty.add((cx, cy))
+                return None
+            asset_manager.put(key, chunk)
+            self.baked.add(key)
+        return chunk
+
+    def bake_chunk(self, cx, cy, native=None):
+        """Рисует клетки чанка из всех слоёв по порядку; None, если рисовать нечего"""
+        size = round(self.tile_size / native.factor) if native else self.tile_size
+        cells = self.level.read_chunks(cx, cy, [index for index, _ in self.sources])
+        chunk = None
+        for index, images in self.sources:
+            tiles = cells.get(index)
+            if tiles is None:
+                continue
+            for i, gid in enumerate(tiles):
+                image = gid and images.get(gid)
+                if image:
+                    if chunk is None:
+                        chunk = self.make_chunk(cx, cy, size)
+                    if native:
+                        image = native.image(image)
+                    y, x = divmod(i, CHUNK_SIZE)
+                    chunk.blit(image, (x * size, y * size))
+        if chunk:
+            # RLE пропускает прозрачные пиксели целыми отрезками, полупрозрачный чанк рисуется в разы быстрее
+            chunk.set_alpha(255, pygame.RLEACCEL)
+        return chunk
+
+    def release(self):
+        """Выбрасывает запечённые чанки из asset_manager (уровень больше не нужен)"""
+        for key in self.visible:
+            asset_manager.unpin(key)
+        for key in self.baked:
+            asset_manager.discard(key)
+        self.visible = set()
+        self.baked = set()
+        self.empty = set()
+
+    def draw(self, surface, offset, native=None):
+        """Рисует видимые чанки; offset - сдвиг камеры (мировые координаты левого верхнего угла surface)
+
+        native - framebuffer.NativeFramebuffer, если surface - его кадр (offset тогда в пикселях текстур)"""
+        chunk_px = round(self.chunk_px / native.factor) if native else self.chunk_px
+        left, top = int(offset[0]), int(offset[1])
+        cx1, cy1 = max(left // chunk_px, 0), max(top // chunk_px, 0)
+        cx2 = (left + surface.get_width()) // chunk_px
+        cy2 = (top + surface.get_height()) // chunk_px
+        visible = set()
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                if (cx, cy) in self.filled:
+                    # пока чанк на экране, кэш его не выбросит, даже если всё видимое не влезает в бюджет
+                    key = self.chunk_key(cx, cy, native)
+                    if key not in self.visible:
+                        asset_manager.pin(key)
+                    visible.add(key)
+                chunk = self.get_chunk(cx, cy, native)
+                if chunk:
+                    surface.blit(chunk, (cx * chunk_px - offset[0], cy * chunk_px - offset[1]))
+        for key in self.visible - visible:
+            asset_manager.unpin(key)
+        self.visible = visible
+
+
+class LevelStreamer:
+    """Подгрузка уровня чанками вокруг камеры
+
+    Пока игрок не подошёл к чанку, от него в памяти только смещение в скомпилированном
+    файле. Когда чанк впервые попадает в область вокруг камеры, его клетки читаются из файла в памяти (mmap):
+    шипы и твёрдые клетки отмечаются в карте коллизий, а предметы и сундуки становятся
+    спрайтами на том же месте в порядке отрисовки, что и при загрузке всего уровня сразу.
+    Дальше они живут как обычно и не выгружаются, так что собранные предметы и открытые
+    сундуки остаются такими, как их оставили. Статичные тайлы рисует TileLayer.
+
+    level - загруженный уровень (level_cache.LevelData)
+
+    tile_cache - его TileCache
+
+    tile_size - размер тайла в пикселях"""
+
+    def __init__(self, level, tile_cache, tile_size):
+        self.level = level
+        self.tile_cache = tile_cache
+        self.tile_size = tile_size
+        self.layers = []  # (индекс слоя в level.layers, первый номер его спрайтов в порядке отрисовки или None)
+        self.loaded = set()  # чанки, которые уже прочитаны
+
+    def add_layer(self, index, order=None):
+        self.layers.append((index, order))
+
+    def load(self, rect):
+        """Подгружает ещё не прочитанные чанки, которые задевает rect (мировые координаты)"""
+        chunk_px = CHUNK_SIZE * self.tile_size
+        cx1, cy1 = max(rect.left // chunk_px, 0), max(rect.top // chunk_px, 0)
+        cx2 = min((rect.right - 1) // chunk_px, (self.level.width - 1) // CHUNK_SIZE)
+        cy2 = min((rect.bottom - 1) // chunk_px, (self.level.height - 1) // CHUNK_SIZE)
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                if (cx, cy) not in self.loaded:
+                    self.load_chunk(cx, cy)
+
+    def load_around(self, player):
+        """Подгружает то, что камера видит и обновляет сейчас, и то, что увидит, когда догонит игрока"""
+        rect = all_sprites.view_rect(all_sprites.active_margin)
+        self.load(rect)
+        rect.center = player.rect.center
+        self.load(rect)
+
+    def load_chunk(self, cx, cy):
+        self.loaded.add((cx, cy))
+        cells = self.level.read_chunks(cx, cy, [index for index, _ in self.layers])
+        sprites = []
+        for index, order in self.layers:
+            tiles = cells.get(index)
+            if tiles is None:
+                continue
+            layer = self.level.layers[index]
+            for i, gid in enumerate(tiles):
+                if gid:
+                    y, x = divmod(i, CHUNK_SIZE)
+                    x, y = cx * CHUNK_SIZE + x, cy * CHUNK_SIZE + y
+                    tile = self.load_tile(layer, x, y, gid)
+                    if tile:
+                        sprites.append(tile)
+                        all_sprites.reinsert(tile, order + y * self.level.width + x)
+        if sprites and level_snapshot:
+            level_snapshot.remember(all_sprites, sprites)
+
+    def load_tile(self, layer, x, y, gid):
+        """Отмечает клетку в карте коллизий; возвращает спрайт, если клетка - предмет или сундук"""
+        tile_cache = self.tile_cache
+        scale = self.tile_size
+        image_tile = tile_cache.image(gid, (scale, scale))
+        if not image_tile:
+            return None
+        properties = tile_cache.properties(gid)
+        tile_type = properties.get("type") if properties else None
+        if tile_type == "spike":
+            collision_map.mark(x, y, KILLING, tile_cache.shape(gid, (scale, scale)))
+        if layer.name != "items" and tile_type != "chest":
+            # обычный тайл ничего не делает, его рисует TileLayer
+            if layer.name == "collide":
+                collision_map.mark(x, y, SOLID)
+            return None
+        tile_args = image_tile, (x * scale, y * scale)
+        shape = tile_cache.shape(gid, (scale, scale))
+        if tile_type == "chest":
+            tile = Chest(*tile_args, shape=shape)
+            tile.opened_image = tile_cache.image(1, (scale, scale))
+            tile.name = "chest"
+            tile.can_use = True
+            tile.coin_image = tile_cache.image(2, (scale, scale))
+            tile.coin_shape = tile_cache.shape(2, (scale, scale))
+            tile.coins = int(properties.get("coins", tile.coins))  # сколько монет высыпается
+        else:
+            tile = Item(*tile_args, shape=shape)
+            if tile_type == "coin":
+                tile = Coin(*tile_args, shape=shape)
+                tile.name = "coin"
+            # if tile_type == "key":
+            #     tile = Coin(*tile_args)
+            #     tile.name = "coin"
+        return tile
+
+
 class Tile(pygame.sprite.Sprite):
     """Объект Тайла
 
     image - текстура тайла
 
-    position - кортеж с координатами в пикселях (x, y)"""
+    position - кортеж с координатами в пикселях (x, y)
+
+    shape - форма для столкновений: None - весь rect, Rect - хитбокс относительно
+    левого верхнего угла, Mask - попиксельно (см. collision.touches)
+
+    Группы коллизий и реестр триггеров тайл меняет сам, только когда меняются
+    solid, killing или can_use, так что в update ему делать нечего."""
 
-    def __init__(self, image, position, mask=True, solid=False, killing=False, gid=None, can_use=False):
+    touch_trigger = False  # реагирует ли на касание игрока (on_collision)
+
+    def __init__(self, image, position, shape=None, solid=False, killing=False, gid=None, can_use=False):
         pygame.sprite.Sprite.__init__(self)
         self.image = image  # уставливается текстура
         # self.area = screen.get_rect()  # ?
         self.rect = pygame.Rect(position[0], position[1], self.image.get_width(), self.image.get_height())
-        if mask:
-            self.mask = pygame.mask.from_surface(self.image)
-        self.solid = solid
-        self.killing = killing
-
-        self.can_use = can_use
+        self.shape = shape  # общая форма из кэша тайлов
+        self._solid = solid
+        self._killing = killing
+        self._can_use = can_use
+        self.sync_groups()
 
         self.display_text = None
         self.use_text = "Нажмите E, чтобы использовать"
 
-    def update(self):
-        if self.solid:
+    @property
+    def solid(self):
+        return self._solid
+
+    @solid.setter
+    def solid(self, value):
+        if value != self._solid:
+            self._solid = value
+            self.sync_groups()
+
+    @property
+    def killing(self):
+        return self._killing
+
+    @killing.setter
+    def killing(self, value):
+        if value != self._killing:
+            self._killing = value
+            self.sync_groups()
+
+    @property
+    def can_use(self):
+        return self._can_use
+
+    @can_use.setter
+    def can_use(self, value):
+        if value != self._can_use:
+            self._can_use = value
+            self.sync_groups()
+
+    def sync_groups(self):
+        """Приводит группы коллизий и реестр триггеров в соответствие с solid, killing и can_use"""
+        if self._solid:
             self.add(collide_tiles)
         else:
             self.remove(collide_tiles)
-        if self.killing:
+        if self._killing:
             self.add(killing_group)
         else:
             self.remove(killing_group)
-
-        if not self.solid:
-            collision = pygame.sprite.collide_mask(self, player)
-            if collision:
-                self.on_collision()
-
-        use_collision = self.rect.colliderect(player.use_rect)
+        # то, что летит в стае, стая и проверяет на касание
+        triggers.register(self, self.touch_trigger and not self._solid and not swarm.has(self), self._can_use)
+
+    def get_state(self):
+        """Изменяемое состояние тайла (для снимка уровня)"""
+        return {"rect": tuple(self.rect), "image": self.image, "solid": self.solid,
+                "killing": self.killing, "can_use": self.can_use}
+
+    def set_state(self, state):
+        self.rect.update(state["rect"])
+        self.image = state["image"]
+        self._solid = state["solid"]
+        self._killing = state["killing"]
+        self._can_use = state["can_use"]
+        self.sync_groups()  # убранный тайл (например, собранный) возвращается в группы
         self.display_text = None
-        if use_collision and self.can_use:
-            self.display_text = self.use_text
-            if pygame.key.get_pressed()[pygame.K_e] and not player.paralich:
-                self.on_use()
+
+    def update(self):
+        pass  # касания и кнопку E раздаёт triggers.dispatch раз в тик
 
     def on_collision(self):
         pass
@@ -178,9 +628,10 @@ class Tile(pygame.sprite.Sprite):
 
 
 class Item(Tile):
+    touch_trigger = True
 
-    def __init__(self, image, position, collectable=False, name="None"):
-        super().__init__(image, position)
+    def __init__(self, image, position, collectable=False, name="None", shape=None):
+        super().__init__(image, position, shape=shape)
 
         self.name = name
 
@@ -191,28 +642,25 @@ class Item(Tile):
         self.max_distance *= self.random_acc
         # print(self.random_acc)
 
-    def update(self):
-        super().update()
+    def get_state(self):
+        return super().get_state() | {"collected": self.collected, "picked_up": self.picked_up}
 
-        p_list = player.picked_up_items
-        if p_list and self in p_list:
-            if p_list.index(self) - 1 >= 0:
-                target_rect = p_list[p_list.index(self) - 1].rect
-            else:
-                target_rect = player.rect
-        else:
-            target_rect = player.rect
-
-        if self.picked_up:
-            a = self.rect.centerx - target_rect.centerx
-            b = self.rect.centery - target_rect.centery
+    def set_state(self, state):
+        super().set_state(state)
+        self.collected = state["collected"]
+        self.picked_up = state["picked_up"]
+        self.sync_swarm()
 
-            self.rect.centerx -= a / self.random_acc
-            self.rect.centery -= b / self.random_acc
+    def in_flight(self):
+        """Летит ли предмет к игроку; такой предмет двигает стая (swarm), а не update"""
+        return self.picked_up
 
-            if abs(a) > self.max_distance or abs(b) > self.max_distance:
-                self.picked_up = False
-                player.picked_up_items.remove(self)
+    def sync_swarm(self):
+        if self.in_flight():
+            self.add(swarm)
+        else:
+            self.remove(swarm)
+        self.sync_groups()
 
     def on_collision(self):
         self.on_pick_up()
@@ -223,11 +671,20 @@ class Item(Tile):
             print("Item", str(self), "picked up!")
             self.picked_up = True
             player.picked_up_items.append(self)
+            all_sprites.pin(self)  # летит за игроком, даже если отстал за край экрана
+            self.sync_swarm()
+
+    def drop(self):
+        """Предмет отстал от игрока слишком далеко и остаётся лежать"""
+        self.picked_up = False
+        player.picked_up_items.remove(self)
+        all_sprites.unpin(self)
+        self.sync_swarm()
 
     def on_collect(self):
         print("Item", str(self), "collected!")
         self.collected = True
-        player.items.append(self)
+        player.items.add(self)
         self.kill()
         pass
 
@@ -237,23 +694,29 @@ class Item(Tile):
 
 class Coin(Item):
 
-    def __init__(self, image, pos, magnet=False):
-        super().__init__(image, pos)
+    def __init__(self, image, pos, magnet=False, shape=None):
+        super().__init__(image, pos, shape=shape)
 
         self.magnet = magnet
         self.random_acc = random.randint(6, 12)
 
-    def update(self):
-        super().update()
+    def get_state(self):
+        return super().get_state() | {"magnet": self.magnet}
 
-        target_rect = player.rect
+    def set_state(self, state):
+        super().set_state(state)
+        self.magnet = state["magnet"]
+        self.sync_swarm()
 
-        if self.magnet:
-            a = self.rect.centerx - target_rect.centerx
-            b = self.rect.centery - target_rect.centery
+    def in_flight(self):
+        return self.picked_up or self.magnet
 
-            self.rect.centerx -= a / self.random_acc
-            self.rect.centery -= b / self.random_acc
+    def attract(self):
+        """Примагничивает монету к игроку, если она ещё на уровне"""
+        if all_sprites.has(self):
+            self.magnet = True
+            all_sprites.pin(self)  # притягивается к игроку откуда угодно
+            self.sync_swarm()
 
     def on_collision(self):
         self.on_collect()
@@ -266,19 +729,27 @@ class Coin(Item):
 
 
 class Chest(Tile):
-    def __init__(self, image, position, key_id=None):
-        super().__init__(image, position)
+    def __init__(self, image, position, key_id=None, shape=None):
+        super().__init__(image, position, shape=shape)
 
         self.key_id = key_id
         print("init ", self)
 
         self.opened = False
         self.coin_image = None
+        self.coin_shape = None
         self.opened_image = None
         self.closed_image = self.image
         self.coins = 10
         self.use_text = "Сундук заперт"
 
+    def get_state(self):
+        return super().get_state() | {"opened": self.opened}
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.opened = state["opened"]
+
     def update(self):
         super().update()
         if self.opened:
@@ -299,7 +770,7 @@ class Chest(Tile):
                 for i in range(self.coins):
                     x = self.rect.x + (random.randint(-8, 8)) * self.rect.width / 2
                     y = self.rect.y + (random.randint(-8, 8)) * self.rect.width / 2
-                    a = Coin(self.coin_image, (x, y))
+                    a = Coin(self.coin_image, (x, y), shape=self.coin_shape)
                     a.add(all_sprites)
                     coins.append(a)
                     pygame.time.set_timer(COINS_MAGNET, 100)
@@ -309,8 +780,8 @@ class Chest(Tile):
 
 class Teleport(Tile):
 
-    def __init__(self, image, position, dest="Unknown"):
-        super().__init__(image, position)
+    def __init__(self, image, position, dest="Unknown", shape=None):
+        super().__init__(image, position, shape=shape)
 
         self.dest = dest
         self.in_use = False
@@ -322,6 +793,13 @@ class Teleport(Tile):
 
         self.use_text = "Нажмите E, чтобы переместиться"
 
+    def get_state(self):
+        return super().get_state() | {"in_use": self.in_use}
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.in_use = state["in_use"]
+
     def update(self):
         super().update()
 
@@ -338,48 +816,46 @@ class Teleport(Tile):
             player.paralich = True
 
 
-def black_screen_fade():
-    surf = color_cor
+def black_screen_fade(surf):
     surf.fill((0, 0, 0))
     return surf
 
 
-def death_screen_fade():
-    surf = color_cor
+def death_screen_fade(surf):
     surf.fill((0, 0, 0))
     image = load_image("death_screen.png")[0]
     surf.blit(image, (0, 0))
     return surf
 
 
+def fade_overlay(func):
+    """Картинка затемнения, нарисованная func; рисуется один раз за игру, дальше меняется только прозрачность"""
+    surf = fade_overlays.get(func)
+    if surf is None:
+        surf = fade_overlays[func] = func(pygame.Surface(screen.get_size()))
+    return surf
+
+
 class Player(pygame.sprite.Sprite):
     """Объект Игрока
 
         pos - кортеж с координатами в пикселях (x, y)"""
 
+    always_active = True
+
     def __init__(self, pos):
         pygame.sprite.Sprite.__init__(self)
         self.image, _ = load_image(PLAYER_IMAGE)
         self.scale = pxs_in_1px  # получаем коэфицент адаптации
         self.scale_image = self.scale  # домножаем масштаб на него
 
-        self.image_width = self.image.get_width() * self.scale_image
-        self.image_height = (self.image.get_height() + 1) * self.scale_image
-        # width = round(width)
-        self.image_height = round(self.image_height)
-        if self.image_height % 2 != 0:
-            self.image_height -= 1
-            self.image_width -= 1
+        self.image_width, self.image_height = player_size(self.image.get_size(), self.scale_image)
 
         # масштабируем маленькую текстуру
         self.image = pygame.transform.scale(self.image, [self.image_width, self.image_height])
 
-        self.idle_anim = self.cut_frames(PLAYER_IDLE)
-        self.walk_anim = self.cut_frames(PLAYER_WALK)
-        self.run_anim = self.cut_frames(PLAYER_RUN)
-        self.cur_frame = 0
-        self.cur_fr_anim = 0
-        self.reverse = False
+        # все кадры, в обе стороны, строятся один раз за процесс
+        self.animations = animation.load_atlas(os.path.join("data", PLAYER_ANIMATIONS), load_image, self.scale_image)
 
         self.src_image = self.image  # запоминаем как было
         # ширина - пол высоты
@@ -389,9 +865,19 @@ class Player(pygame.sprite.Sprite):
         self.rect = pygame.Rect(pos[0], pos[1], w, self.image.get_height())
         self.use_radius = 2
 
-        self.use_rect = self.rect.scale_by(self.use_radius, self.use_radius)
+        # self.gr = None
+
+        self.items = hud.Inventory()
+        self.reset(pos)
 
-        self.mask = pygame.mask.from_surface(pygame.surface.Surface(self.rect.size))
+    def reset(self, pos):
+        """Возвращает игрока в начальное состояние в точке pos (при перезапуске уровня)"""
+        self.image = self.src_image
+        self.rect.topleft = pos
+        self.use_rect = self.rect.scale_by(self.use_radius, self.use_radius)
+        self.cur_frame = 0
+        self.cur_fr_anim = 0
+        self.reverse = False
         self.jumping = False  # прыжок
         self.onGround = False  # тег "на земле"
         self.velocity = [.0, .0]  # вектор скорости
@@ -399,27 +885,7 @@ class Player(pygame.sprite.Sprite):
         self.right = False  # идём вправо
         self.sprint = False  # бежим
         self.paralich = False
-        # self.gr = None
-
         self.picked_up_items = []
-        self.items = []
-
-    def cut_frames(self, anim):
-        image_name, n, _ = anim
-        surf = load_image(image_name)[0]
-        image_width = surf.get_width() * self.scale_image
-        image_height = surf.get_height() * self.scale_image
-        # width = round(width)
-        image_height = round(image_height)
-        if image_height % 2 != 0:
-            image_height -= 1
-            image_width -= 1
-        surf = pygame.transform.scale(surf, (image_width, image_height))
-        animation = []
-        for i in range(n):
-            new_surf = surf.subsurface(surf.get_width() // n * i, 0, surf.get_width() // n, surf.get_height())
-            animation.append(new_surf)
-        return animation
 
     def jump(self):
         if self.onGround:  # если на земле
@@ -454,78 +920,96 @@ class Player(pygame.sprite.Sprite):
             self.velocity[1] -= JUMP_V * self.scale
             self.jumping = False  # не прыгаем уже!
 
+        start = self.rect.copy()
         self.rect.x += self.velocity[0]  # применяем вектор скорости к х оси
-        self.check_x_collisions()  # проверяем коллизии
+        self.check_x_collisions(start)  # проверяем коллизии
 
+        start = self.rect.copy()
         self.rect.y += self.velocity[1]  # применяем вектор скорости к у оси
-        self.check_y_collisions()  # проверяем столкновения
+        self.check_y_collisions(start)  # проверяем столкновения
 
         self.use_rect = self.rect.scale_by(self.use_radius, self.use_radius)
 
         self.check_touch_danger()
 
         if self.velocity[0] == 0:
-            current_anim = self.idle_anim
-            current_anim_conf = PLAYER_IDLE
+            current_anim = "idle"
+        elif self.sprint:
+            current_anim = "run"
         else:
-            current_anim = self.walk_anim
-            current_anim_conf = PLAYER_WALK
-            if self.sprint:
-                current_anim = self.run_anim
-                current_anim_conf = PLAYER_RUN
+            current_anim = "walk"
         self.cur_frame += 1
-        if self.cur_frame >= 60 // current_anim_conf[2]:
+        if self.cur_frame >= TICK_RATE // self.animations.fps[current_anim]:
             self.cur_frame = 0
             self.cur_fr_anim = self.cur_fr_anim + 1
-        self.cur_fr_anim = self.cur_fr_anim % len(current_anim)
-        self.image = self.check_reverse(current_anim[self.cur_fr_anim])
-
-    def check_reverse(self, frame):
-        if self.reverse:
-            return pygame.transform.flip(frame, 1, 0)
-        else:
-            return frame
+        self.cur_fr_anim = self.cur_fr_anim % self.animations.length(current_anim)
+        self.image = self.animations.frame(current_anim, self.cur_fr_anim, self.reverse)
 
     def check_touch_danger(self):
-        spike_collisions = []
-        for spike in killing_group.sprites():
-            spike_collisions.append(pygame.sprite.collide_mask(self, spike))
-        if any(spike_collisions):
+        if collision_map.touches_killing(self.rect):
+            self.kill()
+            return
+        if any(touches(spike.shape, spike.rect, self.rect) for spike in killing_group):
             self.kill()
 
-    def check_x_collisions(self):
-        collisions = pygame.sprite.spritecollide(self, collide_tiles, False)
-
-        for tile in collisions:  # для каждого тайла, с которым можно сталкиваться
-            if self.velocity[0] > 0:  # если направляемся вправо
-                self.rect.right = tile.rect.left  # спотыкаемся
-                self.velocity[0] = 0  # лежим
-            elif self.velocity[0] < 0:  # если направляемся вправо
-                self.rect.left = tile.rect.right  # спотыкаемся
-                self.velocity[0] = 0  # лежим
-
-    def check_y_collisions(self):
-        collisions = pygame.sprite.spritecollide(self, collide_tiles, False)
-
-        for tile in collisions:  # для каждого тайла, с которым можно сталкиваться
-            if self.velocity[1] > 0:  # если летим вниз
-                self.rect.bottom = tile.rect.top  # ударёмся ногой
-                self.onGround = True  # упали на землю
-                self.velocity[1] = 0  # лежим
-            elif self.velocity[1] < 0:  # если прягаем вверх
-                self.rect.top = tile.rect.bottom  # ударёмся головой
-                self.velocity[1] = 0  # не мотаем головой лишний раз
-
-
-class CameraGroup(pygame.sprite.Group):
+    def get_collisions(self, rect=None):
+        """Прямоугольники всего твёрдого, что задевает rect (по умолчанию - сам игрок):
+        клетки карты коллизий и твёрдые спрайты"""
+        if rect is None:
+            rect = self.rect
+        collisions = collision_map.solid_rects(rect)
+        # только из соседних ячеек сетки
+        collisions += [tile.rect for tile in collide_tiles.query(rect) if rect.colliderect(tile.rect)]
+        return collisions
+
+    def get_swept_collisions(self, start):
+        """Твёрдое на всём пути от start до текущего rect за этот тик
+
+        Берётся полоса, которую игрок заметает, а не только конечное положение, поэтому на
+        любой скорости нельзя проскочить сквозь тонкий пол. Из того, что было задето ещё в start,
+        остаётся только то, во что игрок упирается и в конце шага - выход из стены не мешает"""
+        path = start.union(self.rect)
+        return [tile_rect for tile_rect in self.get_collisions(path)
+                if not start.colliderect(tile_rect) or self.rect.colliderect(tile_rect)]
+
+    def check_x_collisions(self, start):
+        """Останавливает игрока у ближайшей стены на пути из start (время столкновения - по этой стене)"""
+        collisions = self.get_swept_collisions(start)  # всё, с чем можно столкнуться по дороге
+        if not collisions:
+            return
+        if self.velocity[0] > 0:  # если направляемся вправо
+            self.rect.right = min(tile_rect.left for tile_rect in collisions)  # спотыкаемся о ближайшую
+            self.velocity[0] = 0  # лежим
+        elif self.velocity[0] < 0:  # если направляемся влево
+            self.rect.left = max(tile_rect.right for tile_rect in collisions)  # спотыкаемся о ближайшую
+            self.velocity[0] = 0  # лежим
+
+    def check_y_collisions(self, start):
+        """Останавливает игрока у ближайшего пола или потолка на пути из start"""
+        collisions = self.get_swept_collisions(start)  # всё, с чем можно столкнуться по дороге
+        if not collisions:
+            return
+        if self.velocity[1] > 0:  # если летим вниз
+            self.rect.bottom = min(tile_rect.top for tile_rect in collisions)  # ударёмся ногой о ближайший пол
+            self.onGround = True  # упали на землю
+            self.velocity[1] = 0  # лежим
+        elif self.velocity[1] < 0:  # если прягаем вверх
+            self.rect.top = max(tile_rect.bottom for tile_rect in collisions)  # ударёмся головой
+            self.velocity[1] = 0  # не мотаем головой лишний раз
+
+
+class CameraGroup(SpatialGroup):
     # спасибо Clear Code (YouTube) (иносказитель)
     def __init__(self):
         super().__init__()
+        self.active_margin = 0  # запас вокруг экрана в пикселях, в котором объекты ещё обновляются
         self.display_surface = pygame.display.get_surface()
         # print(screen.get_width())
 
         # camera offset
         self.offset = pygame.math.Vector2()
+        self.prev_offset = pygame.math.Vector2()  # сдвиг камеры на предыдущем тике, для интерполяции
+        self.previous = {}  # спрайт -> его topleft на предыдущем тике (только обновлявшиеся спрайты)
         self.half_w = self.display_surface.get_size()[0] // 2
         self.half_h = self.display_surface.get_size()[1] // 2
 
@@ -541,12 +1025,6 @@ class CameraGroup(pygame.sprite.Group):
         self.camera_rect = pygame.Rect(l, t, w, h)
 
         self.level = None
-        self.bg_image = "bg.jpg"
-
-        # ground
-        self.background_surf = load_image(self.bg_image)[0]
-        # self.background_surf = pygame.transform.scale(self.background_surf, (screen.get_width()*3, self.background_surf.get_height()))
-        self.background_rect = self.background_surf.get_rect(topleft=(0, 0))
 
         # camera speed
         self.keyboard_speed = 5
@@ -557,9 +1035,6 @@ class CameraGroup(pygame.sprite.Group):
         self.internal_surf_size = (screen.get_width(), screen.get_height())
         self.internal_surf = pygame.Surface(self.internal_surf_size, pygame.SRCALPHA)
 
-        self.text_surf_size = (screen.get_width(), screen.get_height())
-        self.text_surf = pygame.Surface(self.internal_surf_size, pygame.SRCALPHA)
-
         # self.internal_surf = pygame.transform.scale(self.internal_surf, screen.get_size())
         self.internal_rect = self.internal_surf.get_rect(center=(self.half_w, self.half_h))
         self.internal_surface_size_vector = pygame.math.Vector2(self.internal_surf_size)
@@ -567,6 +1042,27 @@ class CameraGroup(pygame.sprite.Group):
         self.internal_offset.x = self.internal_surf_size[0] // 2 - self.half_w
         self.internal_offset.y = self.internal_surf_size[1] // 2 - self.half_h
 
+        # ground: слои фона под размер экрана, а не уровня
+        self.background = background.Background.load(os.path.join("data", BACKGROUND))
+        self.background.resize(asset_manager, self.internal_surf_size)
+
+        self.native = None  # framebuffer.NativeFramebuffer, если мир рисуется в разрешении текстур
+
+        # перерисовка только изменившихся областей (см. custom_draw)
+        self.dirty = False
+        self.drawn = {}  # спрайт -> (прямоугольник на экране, картинка) в прошлом кадре
+        self.drawn_texts = []  # (прямоугольник, картинка) подсказок в прошлом кадре
+        self.drawn_origin = None  # где была камера в прошлом кадре
+        self.drawn_level = None
+
+    def set_native(self, factor):
+        """Включает отрисовку мира в разрешении текстур; factor - пикселей экрана в пикселе текстуры"""
+        if self.native and self.native.factor == factor:
+            self.native.clear()  # картинки прошлого уровня больше не нужны
+            return
+        self.native = framebuffer.NativeFramebuffer(self.internal_surf_size, factor)
+        self.background.resize(asset_manager, self.native.size)
+
     def center_target_camera(self, target):
         self.offset.x = target.rect.centerx - self.half_w
         self.offset.y = target.rect.centery - self.half_h
@@ -585,112 +1081,301 @@ class CameraGroup(pygame.sprite.Group):
         self.offset.x = self.camera_rect.left - self.camera_borders['left']
         self.offset.y = self.camera_rect.top - self.camera_borders['top']
 
-    def custom_draw(self, player):
-        self.text_surf.fill((0, 0, 0, 0))
-
-        if self.level:
-            width = round(self.level.width * self.level.tilewidth * player.scale * pxs_in_1px)
-            height = round(self.level.height * self.level.tilewidth * player.scale * pxs_in_1px)
-            if self.background_surf.get_width() != width:
-                self.background_surf = load_image(self.bg_image)[0]
-                self.background_surf = pygame.transform.scale(self.background_surf, (width, height))
-                self.background_rect = self.background_surf.get_rect(topleft=(0, 0))
-
+    def view_rect(self, margin=0, offset=None):
+        """Видимая камерой область в мировых координатах, расширенная на margin с каждой стороны
+
+        offset - сдвиг камеры, по умолчанию текущий"""
+        if offset is None:
+            offset = self.offset
+        rect = pygame.Rect(offset - self.internal_offset, self.internal_surf_size)
+        return rect.inflate(margin * 2, margin * 2)
+
+    def update(self, *args, **kwargs):
+        """Обновляет только спрайты рядом с камерой и закреплённые
+
+        Заодно запоминает, где они и камера были до этого тика, чтобы рисовать между тиками.
+        Летящие к игроку предметы пропускаются: их двигает стая (swarm), она же помнит их прошлые места"""
+        self.prev_offset.update(self.offset)
+        self.previous = {}
+        for sprite in self.active(self.view_rect(self.active_margin), exclude=swarm.index):
+            topleft = self.previous[sprite] = sprite.rect.topleft
+            sprite.update(*args, **kwargs)
+            if sprite.rect.topleft != topleft:
+                self.move(sprite)  # спрайт мог сдвинуться в другую ячейку
+                triggers.move(sprite)
+
+    def lerp_pos(self, sprite, alpha):
+        """Позиция спрайта между предыдущим и последним тиком"""
+        x, y = sprite.rect.topleft
+        previous = self.previous.get(sprite)
+        if previous is None or previous == (x, y):
+            return pygame.math.Vector2(x, y)
+        return pygame.math.Vector2(round(previous[0] + (x - previous[0]) * alpha),
+                                   round(previous[1] + (y - previous[1]) * alpha))
+
+    def custom_draw(self, player, alpha=1.0, full=True, extra=()):
+        """Рисует видимую часть уровня
+
+        alpha - доля пути от предыдущего тика к последнему (1 - рисовать как есть)
+
+        full - перерисовать весь экран; если False и включён dirty, а камера не сдвинулась,
+        перерисовываются только области, где что-то сдвинулось или сменило картинку
+
+        extra - ещё области экрана, которые надо перерисовать (например, изменившийся интерфейс)
+
+        Возвращает перерисованные области или None, если перерисован весь экран"""
         # self.center_target_camera(player)
-        self.box_target_camera(player)
+        # камера двигается в game_tick, здесь она только рисуется между тиками
+        offset = self.prev_offset.lerp(self.offset, alpha)
+        offset.update(round(offset.x), round(offset.y))
         # self.keyboard_control()
         # self.mouse_control()
         # self.zoom_keyboard_control()
 
-        self.internal_surf.fill('#71ddee')  # льём небо
-
-        # ground
-        ground_offset = self.background_rect.topleft - self.offset + self.internal_offset
-        self.internal_surf.blit(self.background_surf, ground_offset)
-
-        # active elements
-        for sprite in self.sprites():
-            offset_pos = sprite.rect.topleft - self.offset + self.internal_offset
+        # мир собирается либо в кадре размером с экран, либо в маленьком кадре native
+        native = self.native
+        surface = native.surface if native else self.internal_surf
+        origin = offset - self.internal_offset  # мировые координаты левого верхнего угла кадра
+        frame_origin = native.to_native(origin) if native else origin  # он же в пикселях кадра
+
+        # active elements: что и где рисуется в этом кадре
+        placed = []  # (спрайт, картинка, позиция в кадре); у слоёв тайлов картинки нет
+        texts = []  # (подсказка, позиция на экране)
+        # закреплённые спрайты могут быть где угодно на уровне - берём только видимые;
+        # стая рисуется отдельно одним blits поверх остальных спрайтов
+        view = self.view_rect(offset=offset)
+        for sprite in self.active(view, exclude=swarm.index, cull=True):
+            if isinstance(sprite, TileLayer):
+                placed.append((sprite, None, None))
+                continue
+            offset_pos = self.lerp_pos(sprite, alpha) - offset + self.internal_offset
             if isinstance(sprite, Player):
                 offset_pos.x -= sprite.image.get_width() / 4
                 offset_pos.y += (sprite.rect.h - sprite.image.get_height())
 
                 pass
 
-            self.internal_surf.blit(sprite.image, offset_pos)
+            if native:
+                placed.append((sprite, native.image(sprite.image), native.to_native(offset_pos + origin) - frame_origin))
+            else:
+                placed.append((sprite, sprite.image, offset_pos))
             if isinstance(sprite, (Chest, Teleport)):
                 # pygame.draw.rect(self.internal_surf, "red", (offset_pos, sprite.rect.size))
                 if sprite.display_text:
-                    font = pygame.font.Font(None, 30)
-                    string_rendered = font.render(sprite.display_text, 1, pygame.Color('black'))
+                    string_rendered = text_cache.render(sprite.display_text)
                     pos = offset_pos
-                    self.text_surf.blit(string_rendered,
-                                        ((pos[0] + sprite.rect.w // 2) - string_rendered.get_width() // 2,
-                                         pos[1] - string_rendered.get_height()))
-
-        # scaled_surf = pygame.transform.scale(self.internal_surf, self.internal_surface_size_vector * self.zoom_scale)
-        scaled_rect = self.internal_surf.get_rect(center=(self.half_w, self.half_h))
-
-        self.display_surface.blit(self.internal_surf, scaled_rect)
-        self.display_surface.blit(self.text_surf, self.text_surf.get_rect(center=(self.half_w, self.half_h)))
-
-
-pygame.init()  # да
-screen = pygame.display.set_mode((0, 0), flags=pygame.FULLSCREEN)  # на весь экран, размер окна - автоматически
-print("Обнаружен экран с разрешением", screen.get_size())
-pxs_in_1px = round((screen.get_width() // 25) * 6 / (1920 // 25))
-print(pxs_in_1px)
-
-# лирическое отступление: Если в windows в параметрах экрана установлен масштаб, отличный от 100 процентов, то
-# разрешение определяется с учётом этого масштаба, причём в меньшую сторону. Если масштаб 100, то разрешение
-# определяется сразу и игра запускается сразу, без кат-сцен в виде мигающего черного экрана. Читы на пропуск кат-сцены
-# В общем игра отображется везде одинаково, так что и ладно.
-
-color_cor = pygame.Surface(screen.get_size())
-
-clock = pygame.time.Clock()  # часы
-running = True  # куда бежим
-dt = 0  # что это воще
-
-# определёем группы спрайтов
-all_sprites = CameraGroup()  # группа всех спрайтов, что движимы камерой
-player_group = pygame.sprite.Group()  # группа игрока, ладно
-collide_tiles = pygame.sprite.Group()  # группа всех спрайтов, что божьей силой не дают провалиться сквозь них
-killing_group = pygame.sprite.Group()
-
-player = Player((0, 0))  # первое зарождение игрока, и да, когда-то давно он жил на (0;0), и что?
-player.add(player_group)  # инвайтим в группу
-
-level, level_scale = gen_level("levels/level1.tmx")  # да, сначала появился игрок, потом весь мир, и что?
-
-# player.add(all_sprites)  # он такое же существо, как и все эти... камни?
-
-debug_text = []
-DEBUG_MODE = False
-
-while running:
-    # poll for events
-    # pygame.QUIT event means the user clicked X to close your window
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_F1:
-                DEBUG_MODE = not DEBUG_MODE
-            if event.key == pygame.K_ESCAPE:  # кнопка выхода
-                running = False  # не бежим
-        if event.type == COINS_MAGNET:
-            for i in coins:
-                i.magnet = True
-
-    screen.fill("purple")  # льём затекстурье. эм... а зачем?...
+                    texts.append((string_rendered,
+                                  ((pos[0] + sprite.rect.w // 2) - string_rendered.get_width() // 2,
+                                   pos[1] - string_rendered.get_height())))
+
+        members, topleft = swarm.visible(view, alpha)  # мировые координаты, уже между тиками
+        if native:
+            images = [native.image(sprite.image) for sprite in members]
+            positions = np.rint(topleft / native.factor) - (frame_origin.x, frame_origin.y)
+        else:
+            images = [sprite.image for sprite in members]
+            positions = topleft - (origin.x, origin.y)
+        flock = list(zip(images, positions.tolist()))  # (картинка, позиция в кадре) для Surface.blits
+
+        rects = None
+        if self.dirty:  # что где нарисовано, запоминаем, только если есть с чем сравнивать
+            drawn = {sprite: (pygame.Rect(pos, image.get_size()), image) for sprite, image, pos in placed if image}
+            drawn.update((sprite, (pygame.Rect(pos, image.get_size()), image))
+                         for sprite, (image, pos) in zip(members, flock))
+            drawn_texts = [(image.get_rect(topleft=pos), image) for image, pos in texts]
+            if not full and not native and self.level is self.drawn_level and frame_origin == self.drawn_origin:
+                rects = self.dirty_rects(drawn, drawn_texts, extra)
+            self.drawn, self.drawn_texts = drawn, drawn_texts
+            self.drawn_origin, self.drawn_level = frame_origin, self.level
+
+        if rects is None:
+            self.draw_world(surface, placed, frame_origin, flock)
+            if native:
+                native.present(self.display_surface)  # одно увеличение на кадр, сразу на экран
+            else:
+                # scaled_surf = pygame.transform.scale(self.internal_surf, self.internal_surface_size_vector * self.zoom_scale)
+                scaled_rect = self.internal_surf.get_rect(center=(self.half_w, self.half_h))
+
+                self.display_surface.blit(self.internal_surf, scaled_rect)
+            for image, pos in texts:
+                self.display_surface.blit(image, pos)
+            return None
+
+        # камера на месте: остальной экран уже нарисован, обновляем только изменившиеся области
+        for rect in rects:
+            surface.set_clip(rect)
+            self.draw_world(surface, placed, frame_origin, flock)
+        surface.set_clip(None)
+        for rect in rects:
+            self.display_surface.set_clip(rect)  # иначе полупрозрачный текст ляжет сам на себя
+            self.display_surface.blit(surface, rect, rect)
+            for image, pos in texts:
+                if rect.colliderect(image.get_rect(topleft=pos)):
+                    self.display_surface.blit(image, pos)
+        self.display_surface.set_clip(None)
+        return rects
+
+    def draw_world(self, surface, placed, frame_origin, flock=()):
+        """Фон, слои тайлов и спрайты в кадр surface (с учётом его области отсечения)
+
+        flock - (картинка, позиция) стаи, рисуются последними одним вызовом blits"""
+        native = self.native
+        bottom = self.level.height * level_scale if self.level else self.internal_surf_size[1]
+        if native:
+            bottom /= native.factor
+
+        if not self.background.covers(surface.get_size()):
+            surface.fill('#71ddee')  # льём небо
 
+        # ground
+        self.background.draw(surface, frame_origin, bottom)
+
+        clip = surface.get_clip()
+        for sprite, image, pos in placed:
+            if image is None:
+                sprite.draw(surface, frame_origin, native)
+            elif clip.colliderect((pos, image.get_size())):
+                surface.blit(image, pos)
+        if flock:
+            surface.blits(flock, doreturn=False)
+
+    def dirty_rects(self, drawn, drawn_texts, extra):
+        """Области экрана, которые поменялись с прошлого кадра, или None, если проще перерисовать всё
+
+        drawn, drawn_texts - то же, что self.drawn и self.drawn_texts, но для этого кадра"""
+        rects = [pygame.Rect(rect) for rect in extra]
+        for sprite, (rect, image) in drawn.items():
+            old = self.drawn.get(sprite)
+            if old is None:
+                rects.append(rect)
+            elif old[0] != rect or old[1] is not image:
+                rects += [rect, old[0]]
+        rects += [rect for sprite, (rect, _) in self.drawn.items() if sprite not in drawn]  # пропавшие
+        if drawn_texts != self.drawn_texts:
+            rects += [rect for rect, _ in drawn_texts + self.drawn_texts]
+
+        # пересекающиеся области сливаются, чтобы не рисовать одно место дважды
+        screen_rect = self.internal_surf.get_rect()
+        merged = []
+        for rect in rects:
+            rect = rect.clip(screen_rect)
+            if not rect.w or not rect.h:
+                continue
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect.union_ip(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        if len(merged) > DIRTY_MAX_RECTS or sum(rect.w * rect.h for rect in merged) > screen_rect.w * screen_rect.h // 2:
+            return None
+        return merged
+
+
+def init_game(size=None, headless=False, vsync=False, native=False, dirty=False):
+    """Создаёт экран, группы спрайтов, игрока и загружает первый уровень
+
+    size - разрешение (w, h); None - во весь экран, а без окна - HEADLESS_SIZE
+
+    headless - без окна: SDL-драйвер dummy, экран - просто поверхность в памяти
+
+    vsync - синхронизировать flip с обновлением экрана (если драйвер умеет); pygame включает
+    vsync только вместе с SCALED (или OPENGL), поэтому окно тогда создаётся с SCALED.
+    Подтвердился ли vsync, видно по vsync_enabled; пока нет, FPS ограничивает clock.tick
+
+    native - рисовать мир в разрешении текстур (см. NATIVE_RENDER)
+
+    dirty - перерисовывать только изменившиеся области, пока камера стоит (см. draw_frame)"""
+    global screen, pxs_in_1px, color_cor, color_cor_func, clock, NATIVE_RENDER, vsync_enabled
+    global all_sprites, player_group, collide_tiles, killing_group, triggers, swarm, level_loader
+    global player, level, level_scale
+
+    NATIVE_RENDER = native
+    if headless:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # до pygame.init, иначе не подхватится
+    pygame.init()  # да
+    flags = 0 if headless or size else pygame.FULLSCREEN  # на весь экран, размер окна - автоматически
+    size = size or (HEADLESS_SIZE if headless else (0, 0))
+    vsync_enabled = False
+    screen = None
+    if vsync and not headless:
+        if size == (0, 0):
+            size = pygame.display.get_desktop_sizes()[0]  # SCALED нужен настоящий размер
+        try:
+            screen = pygame.display.set_mode(size, flags=flags | pygame.SCALED, vsync=1)
+            # is_vsync есть не во всех версиях pygame; не можем проверить - FPS всё равно ограничиваем
+            is_vsync = getattr(pygame.display, "is_vsync", None)
+            vsync_enabled = bool(is_vsync and is_vsync())
+        except pygame.error:  # vsync поддерживается не везде
+            screen = None
+    if screen is None:
+        screen = pygame.display.set_mode(size, flags=flags)
+    print("Обнаружен экран с разрешением", screen.get_size())
+    pxs_in_1px = screen_scale(screen.get_width())
+    print(pxs_in_1px)
+
+    # лирическое отступление: Если в windows в параметрах экрана установлен масштаб, отличный от 100 процентов, то
+    # разрешение определяется с учётом этого масштаба, причём в меньшую сторону. Если масштаб 100, то разрешение
+    # определяется сразу и игра запускается сразу, без кат-сцен в виде мигающего черного экрана. Читы на пропуск кат-сцены
+    # В общем игра отображется везде одинаково, так что и ладно.
+
+    fade_overlays.clear()  # под новый размер экрана
+    color_cor_func = black_screen_fade
+    color_cor = fade_overlay(color_cor_func)
+
+    clock = pygame.time.Clock()  # часы
+
+    # определёем группы спрайтов
+    if all_sprites is not None:
+        all_sprites.background.release(asset_manager)  # фон прошлой группы больше не рисуется
+    all_sprites = CameraGroup()  # группа всех спрайтов, что движимы камерой
+    all_sprites.dirty = dirty
+    player_group = pygame.sprite.Group()  # группа игрока, ладно
+    collide_tiles = SpatialGroup()  # группа всех спрайтов, что божьей силой не дают провалиться сквозь них
+    killing_group = pygame.sprite.Group()
+    triggers = TriggerRegistry()
+    swarm = Swarm()
+    level_loader = level_cache.LevelLoader()  # фоновая подготовка уровней, куда ведут телепорты
+
+    player = Player((0, 0))  # первое зарождение игрока, и да, когда-то давно он жил на (0;0), и что?
+    player.add(player_group)  # инвайтим в группу
+
+    level, level_scale = gen_level(f"levels/{CURRENT_LEVEL}")  # да, сначала появился игрок, потом весь мир, и что?
+
+    # player.add(all_sprites)  # он такое же существо, как и все эти... камни?
+
+
+def game_tick(render=True):
+    """Один тик симуляции: ввод, мир, камера, затемнения и переходы между уровнями
+
+    Скорости и ускорения заданы на тик, так что игра идёт одинаково при любом FPS.
+
+    render - будет ли кадр рисоваться (иначе не готовим картинку затемнения)"""
+    global running, DEBUG_MODE, FADE_OUT, color_cor, color_cor_func, CURRENT_LEVEL, teleport
+
+    keys = read_input()  # какие кнопочки классные!!! (получаем список нажатых кнопок)
+    if keys.events & replay.QUIT:
+        running = False  # не бежим
+    if keys.events & replay.DEBUG:
+        DEBUG_MODE = not DEBUG_MODE
+    if keys.events & replay.MAGNET:
+        for i in coins:
+            i.attract()
+    frame_profiler.mark("events")
+
+    # чанки вокруг камеры подгружаются до того, как объекты рядом с ними начнут обновляться
+    level_streamer.load_around(player)
     all_sprites.update()
-    all_sprites.custom_draw(player)  # кастомно применяем алгоритмы камеры
+    # вся стая летит к игроку одним векторным шагом и одной проверкой касания
+    for item in swarm.update(player.rect.center, player.picked_up_items):
+        item.drop()
+    for sprite in swarm.hits(player.rect):
+        if touches(sprite.shape, sprite.rect, player.rect):
+            sprite.on_collision()
+    triggers.dispatch(player.rect, player.use_rect, keys[pygame.K_e] and not player.paralich)
+    all_sprites.box_target_camera(player)  # камера двигается вместе с миром, от неё зависит, кто обновляется
 
     player.right, player.left, player.sprint = False, False, False  # сбрасываем
 
-    keys = pygame.key.get_pressed()  # какие кнопочки классные!!! (получаем список нажатых кнопок)
     if keys and not player.paralich:
         if keys[pygame.K_w] or keys[pygame.K_SPACE]:  # Ц или Пробел
             player.jump()  # прыжок
@@ -711,25 +1396,115 @@ while running:
             restart(CURRENT_LEVEL)
             color_cor_func = black_screen_fade
             FADE_OUT = 256 + 5
+    frame_profiler.mark("update")
 
-    # HUD
-    items = {}
-    if player.items:
-        for item in player.items:
+    if FADE_OUT == 1 and render:
+        color_cor = fade_overlay(color_cor_func)
 
-            if items.get(item.name):
-                count = items[item.name][0] + 1
-                items[item.name] = (count, item)
-            else:
-                count = 1
-                items[item.name] = (count, item)
-        # print(items)
+    if FADE_OUT == -1:
+        pass  # экран смерти висит, пока не нажмут R
+    elif 0 < FADE_OUT <= 256 + 256:
+        FADE_OUT += 5
+    else:
+        FADE_OUT = 0
+    frame_profiler.mark("fade")
+
+    if FADE_OUT == 256:
+        if teleport:
+            CURRENT_LEVEL = teleport.dest
+            restart(CURRENT_LEVEL)
+            teleport = None
+        if not player.groups():
+            FADE_OUT = -1
+    frame_profiler.mark("update")
+
+
+def draw_frame(alpha=1.0):
+    """Рисует кадр: мир, интерфейс и затемнение
+
+    alpha - доля пути от предыдущего тика к последнему, по ней камера и объекты
+    рисуются между тиками, когда кадры идут чаще или реже физики
+
+    В режиме dirty (--dirty) кадр без затемнения и отладки, в котором камера не
+    сдвинулась, перерисовывается и выводится на экран только там, где что-то поменялось"""
+    global fade_drawn, debug_drawn
+    if all_sprites.dirty and FADE_OUT == fade_drawn == -1 and not DEBUG_MODE and not debug_drawn:
+        frame_profiler.mark("draw")
+        return  # экран смерти уже нарисован и стоит неподвижно
+    # затемнение и отладка ложатся на весь экран, с ними (и сразу после них) кадр рисуется целиком
+    full = not all_sprites.dirty or DEBUG_MODE or debug_drawn or FADE_OUT != 0 or fade_drawn != 0
+    if full:
+        screen.fill("purple")  # льём затекстурье. эм... а зачем?...
+    # кастомно применяем алгоритмы камеры
+    rects = all_sprites.custom_draw(player, alpha, full, inventory_hud.prepare(player.items))
+    frame_profiler.mark("draw")
+
+    draw_hud(rects)
+    frame_profiler.mark("hud")
+
+    if FADE_OUT == -1:
+        color_cor.set_alpha(255)
+        screen.blit(color_cor, (0, 0))
+    elif 0 < FADE_OUT < 256:
+        # color_cor.fill(pygame.Color(0, 0, 0))
+        # color_cor_func()
+        color_cor.set_alpha(FADE_OUT)
+        screen.blit(color_cor, (0, 0))
+    elif 256 <= FADE_OUT <= 256 + 256:
+        # color_cor.fill(pygame.Color(0, 0, 0))
+        # color_cor_func()
+        color_cor.set_alpha(256 * 2 - FADE_OUT)
+        screen.blit(color_cor, (0, 0))
+    fade_drawn, debug_drawn = FADE_OUT, DEBUG_MODE
+    frame_profiler.mark("fade")
+
+    if rects is None:
+        pygame.display.flip()  # обновляем кадр
+    elif rects:
+        pygame.display.update(rects)  # только изменившиеся области
+    frame_profiler.mark("flip")
+
+
+def read_input():
+    """Ввод текущего кадра: с клавиатуры или из записи, если она воспроизводится
+
+    Записанный ввод сохраняется в input_recorder. При воспроизведении настоящие
+    таймеры и клавиши игры не трогают, работают только выход и F1"""
+    events = 0
+    # poll for events
+    # pygame.QUIT event means the user clicked X to close your window
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            events |= replay.QUIT
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_F1:
+                events |= replay.DEBUG
+            if event.key == pygame.K_ESCAPE:  # кнопка выхода
+                events |= replay.QUIT
+        if event.type == COINS_MAGNET:
+            events |= replay.MAGNET
+
+    if input_replay:
+        frame = input_replay.next()
+        if frame is None:  # запись кончилась
+            return replay.FrameInput(events=replay.QUIT)
+        frame.events |= events & (replay.QUIT | replay.DEBUG)
+    else:
+        frame = replay.FrameInput.from_pressed(pygame.key.get_pressed(), events)
+
+    if input_recorder:
+        input_recorder.record(frame)
+    return frame
+
+
+def draw_hud(rects=None):
+    """Инвентарь и отладочный режим поверх мира
+
+    rects - перерисованные области экрана, если кадр рисовался не целиком (см. draw_frame)"""
+    global debug_text
 
-        for name, (count, obj) in items.items():
-            screen.blit(obj.image, (0, 0))
-            font = pygame.font.Font(None, 30)
-            string_rendered = font.render(str(count), 1, pygame.Color('black'))
-            screen.blit(string_rendered, (obj.image.get_width() + 10, obj.image.get_height() // 2))
+    # HUD: слой инвентаря перерисовывается, только когда что-то собрали
+    inventory_hud.draw(screen, player.items, rects)
 
     # дежукер (отладочный режим)
     if DEBUG_MODE:
@@ -745,10 +1520,9 @@ while running:
         #     text_rect.y = obj.rect.y
         #     screen.blit(string_rendered, text_rect)
 
-        font = pygame.font.Font(None, 30)
         text_coord = 50
         for line in debug_text:
-            string_rendered = font.render(line, 1, pygame.Color('black'))
+            string_rendered = text_cache.render(line)
             intro_rect = string_rendered.get_rect()
             text_coord += 5
             intro_rect.top = text_coord
@@ -762,43 +1536,114 @@ while running:
                       f"SPRINT {player.sprint}",
                       f"CUR_FR_ANIM {player.cur_fr_anim}",
                       f"CUR_FR {player.cur_frame}",
-                      f"FADE {FADE_OUT}"]
+                      f"FADE {FADE_OUT}",
+                      asset_manager.stats()]
 
-    if FADE_OUT == 1:
-        color_cor_func()
+        frame_profiler.draw(screen, (screen.get_width() - 300, 50))  # куда уходит время кадра, мс
 
-    if FADE_OUT == -1:
-        color_cor.set_alpha(255)
-        screen.blit(color_cor, (0, 0))
 
-    elif 0 < FADE_OUT < 256:
-        # color_cor.fill(pygame.Color(0, 0, 0))
-        # color_cor_func()
-        color_cor.set_alpha(FADE_OUT)
-        screen.blit(color_cor, (0, 0))
-        FADE_OUT += 5
-    elif 256 <= FADE_OUT <= 256 + 256:
-        # color_cor.fill(pygame.Color(0, 0, 0))
-        # color_cor_func()
-        color_cor.set_alpha(256 * 2 - FADE_OUT)
-        screen.blit(color_cor, (0, 0))
-        FADE_OUT += 5
-    else:
-        FADE_OUT = 0
+def run(frames=None, render=True, fps=60, lockstep=False):
+    """Игровой цикл с фиксированным шагом физики
 
-    if FADE_OUT == 256:
-        if teleport:
-            CURRENT_LEVEL = teleport.dest
-            restart(CURRENT_LEVEL)
-            teleport = None
-        if not player.groups():
-            FADE_OUT = -1
+    Прошедшее время копится в accumulator и расходуется тиками по 1 / TICK_RATE
+    секунды, а кадр рисуется с интерполяцией между двумя последними тиками.
+
+    frames - остановиться после стольких кадров (None - пока не выйдут)
 
-    pygame.display.flip()  # обновляем кадр
+    fps - ограничение кадров в секунду (0 - без ограничения, например при vsync)
 
-    # limits FPS to 60
-    # dt is delta time in seconds since last frame, used for framerate-
-    # independent physics.
-    dt = clock.tick(60) / 1000  # считаем кадры
+    lockstep - ровно один тик на кадр, без оглядки на часы (замеры, воспроизведение на максимальной скорости)
 
-pygame.quit()  # выйдите
+    Возвращает кортеж (число кадров, секунды)"""
+    global running, dt
+    running = True  # куда бежим
+    count = 0
+    tick = 1 / TICK_RATE
+    accumulator = 0
+    start = previous = time.perf_counter()
+    while running and (frames is None or count < frames):
+        frame_profiler.start()
+        if lockstep:
+            ticks = 1
+        else:
+            now = time.perf_counter()
+            accumulator += now - previous
+            previous = now
+            ticks = min(int(accumulator / tick), MAX_TICKS)
+            accumulator -= ticks * tick
+            accumulator = min(accumulator, tick)  # не догнали за MAX_TICKS - отстаём, а не копим долг
+
+        level_loader.poll()  # доделываем уровни, прочитанные в фоне
+        frame_profiler.mark("loader")
+
+        for _ in range(ticks):
+            game_tick(render)
+            if not running:
+                break
+        if render:
+            draw_frame(1.0 if lockstep else accumulator / tick)
+        count += 1
+
+        dt = clock.tick(fps) / 1000  # считаем кадры
+        frame_profiler.mark("wait")
+        frame_profiler.end(CURRENT_LEVEL)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Платформер на pygame")
+    parser.add_argument("--headless", action="store_true",
+                        help="без окна (SDL-драйвер dummy) и без ограничения FPS - для замеров и CI")
+    parser.add_argument("--size", help="разрешение экрана, например 1920x1080")
+    parser.add_argument("--no-render", action="store_true", help="только симуляция, без отрисовки")
+    parser.add_argument("--frames", type=int, help="выйти после стольких кадров")
+    parser.add_argument("--fps", type=int, default=60, help="ограничение FPS, 0 - без ограничения (физика всё равно TICK_RATE)")
+    parser.add_argument("--vsync", action="store_true", help="ждать обновления экрана (окно SCALED); пока vsync не подтверждён, FPS ограничен")
+    parser.add_argument("--native", action="store_true",
+                        help="собирать кадр мира в разрешении текстур и увеличивать его один раз")
+    parser.add_argument("--dirty", action="store_true",
+                        help="пока камера стоит, перерисовывать только изменившиеся области (без --native)")
+    parser.add_argument("--lockstep", action="store_true",
+                        help="ровно один тик физики на кадр (при --headless включено всегда)")
+    parser.add_argument("--record", metavar="FILE", help="записать ввод по кадрам в файл")
+    parser.add_argument("--replay", metavar="FILE", help="воспроизвести записанный ввод")
+    parser.add_argument("--seed", type=int, help="seed для random (при --replay берётся из записи)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="выгружать время частей кадра: *.csv - таблицей, иначе JSON lines")
+    args = parser.parse_args()
+
+    global CURRENT_LEVEL, input_recorder, input_replay, frame_profiler
+    if args.profile:
+        frame_profiler = profiler.FrameProfiler(FRAME_PHASES, args.profile, idle=("wait",))
+    seed = args.seed
+    size = tuple(int(side) for side in args.size.lower().split("x")) if args.size else None
+    if args.replay:
+        input_replay = replay.InputReplay(args.replay)
+        seed = input_replay.seed
+        size = input_replay.size  # масштаб, а значит и физика, зависят от разрешения
+        CURRENT_LEVEL = input_replay.level
+    elif args.record and seed is None:
+        seed = random.randrange(2 ** 32)  # запоминаем, чтобы монеты разлетелись так же
+    if seed is not None:
+        random.seed(seed)
+    level_name = CURRENT_LEVEL
+
+    init_game(size, headless=args.headless, vsync=args.vsync, native=args.native, dirty=args.dirty)
+    if args.record:
+        input_recorder = replay.InputRecorder(args.record, seed, screen.get_size(), level_name)
+    fps = 0 if args.headless or vsync_enabled else args.fps  # без настоящего vsync ограничиваем сами
+    count, seconds = run(args.frames, render=not args.no_render, fps=fps, lockstep=args.lockstep or args.headless)
+    if args.headless:
+        print(f"Кадров: {count} за {seconds:.2f} с ({count / max(seconds, 1e-9):.0f} кадров/с)")
+    if input_replay:
+        print(f"Конец записи: уровень {CURRENT_LEVEL}, игрок на {player.rect.topleft}, предметов {len(player.items)}")
+
+    if input_recorder:
+        input_recorder.save()
+    frame_profiler.close()
+    level_loader.shutdown()
+    pygame.quit()  # выйдите
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Замеры времени кадра по частям (событиям, обновлению, отрисовке и т.д.)
+
+Кадр размечается вызовами mark(phase) после каждой части: время части - это
+время с предыдущей отметки, так что на кадр уходит всего несколько вызовов
+time.perf_counter(). Замеры копятся всегда, а оверлей рисуется только в
+отладочном режиме (F1)."""
+import collections
+import csv
+import json
+import time
+
+import pygame
+
+WINDOW = 240  # сколько последних кадров учитывается в средних и перцентилях (4 секунды при 60 FPS)
+STATS_EVERY = 15  # раз в сколько кадров пересчитывать таблицу оверлея, чтобы не сортировать каждый кадр
+BUDGET_MS = 1000 / 60  # бюджет кадра, рисуется линией на графике
+
+
+def percentile(values, fraction):
+    """Перцентиль по уже отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class FrameProfiler:
+    """Скользящие замеры частей кадра и их выгрузка в файл
+
+    phases - имена частей кадра в порядке выполнения
+
+    idle - части из phases, где игра ничего не делает (ожидание в clock.tick): в работу кадра,
+    график и его цвет они не входят, а видны только своей строкой
+
+    export - путь к файлу: *.csv - таблица, иначе JSON lines (по объекту на кадр)"""
+
+    def __init__(self, phases, export=None, idle=()):
+        self.phases = tuple(phases)
+        self.idle = tuple(idle)
+        self.samples = {phase: collections.deque(maxlen=WINDOW) for phase in self.phases}
+        self.work = collections.deque(maxlen=WINDOW)  # время кадра без ожидания
+        self.frame = 0
+        self.start()  # mark() работает и без run(), например при тиках из тестов и замеров
+        self.stats = []  # строки таблицы оверлея: (часть, среднее, p95, p99)
+        self.table = None  # отрисованная таблица, обновляется вместе со stats
+        self.font = None
+
+        self.file = None
+        self.writer = None
+        if export:
+            self.file = open(export, "w", newline="", encoding="utf-8")
+            if export.endswith(".csv"):
+                self.writer = csv.writer(self.file)
+                self.writer.writerow(("frame", "level") + self.phases + ("work", "total"))
+
+    def start(self):
+        """Начало кадра"""
+        self.current = dict.fromkeys(self.phases, 0.0)
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Конец части кадра phase; повторные отметки одной части складываются"""
+        now = time.perf_counter()
+        self.current[phase] += (now - self.last) * 1000
+        self.last = now
+
+    def end(self, level=None):
+        """Конец кадра: запоминает замеры и дописывает строку в файл выгрузки
+
+        level - имя уровня, чтобы сравнивать производительность по уровням"""
+        total = sum(self.current.values())
+        work = total - sum(self.current[phase] for phase in self.idle)
+        for phase in self.phases:
+            self.samples[phase].append(self.current[phase])
+        self.work.append(work)
+        self.frame += 1
+        if self.frame % STATS_EVERY == 0:
+            self.stats = None  # пересчитаем, когда понадобится оверлею
+
+        if self.writer:
+            self.writer.writerow([self.frame, level] + [round(self.current[phase], 3) for phase in self.phases]
+                                 + [round(work, 3), round(total, 3)])
+        elif self.file:
+            row = {"frame": self.frame, "level": level}
+            row.update((phase, round(self.current[phase], 3)) for phase in self.phases)
+            row["work"] = round(work, 3)
+            row["total"] = round(total, 3)
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def summary(self):
+        """Строки (часть, среднее, p95, p99) в миллисекундах по последним WINDOW кадрам
+
+        Последняя строка work - кадр без частей idle"""
+        rows = []
+        for phase, values in list(self.samples.items()) + [("work", self.work)]:
+            ordered = sorted(values)
+            average = sum(ordered) / len(ordered) if ordered else 0.0
+            rows.append((phase, average, percentile(ordered, 0.95), percentile(ordered, 0.99)))
+        return rows
+
+    def draw(self, surface, position):
+        """Рисует таблицу частей кадра и график времени кадра, верхний левый угол - position"""
+        if not self.stats:
+            self.stats = self.summary()
+            self.table = None
+        if self.table is None:
+            self.table = self.render_table()
+        x, y = position
+        surface.blit(self.table, position)
+        y += self.table.get_height()
+
+        # график: по столбику на кадр, высота - работа кадра без ожидания, линия - бюджет 60 FPS
+        height = 80
+        scale = height / (BUDGET_MS * 2)
+        y += 5
+        pygame.draw.rect(surface, pygame.Color(0, 0, 0), (x, y, WINDOW, height), 1)
+        for i, work in enumerate(self.work):
+            bar = min(round(work * scale), height)
+            color = "green" if work <= BUDGET_MS else "red"
+            pygame.draw.line(surface, color, (x + i, y + height - 1), (x + i, y + height - bar))
+        budget_y = y + height - round(BUDGET_MS * scale)
+        pygame.draw.line(surface, "yellow", (x, budget_y), (x + WINDOW - 1, budget_y))
+
+    def render_table(self):
+        """Таблица частей кадра; перерисовывается раз в STATS_EVERY кадров, а не каждый кадр"""
+        if self.font is None:
+            self.font = pygame.font.Font(None, 24)
+        rows = [("", "avg", "p95", "p99")]
+        rows += [(phase, f"{average:.2f}", f"{p95:.2f}", f"{p99:.2f}") for phase, average, p95, p99 in self.stats]
+        line = self.font.get_linesize() + 2
+        table = pygame.Surface((300, line * len(rows)), pygame.SRCALPHA)
+        y = 0
+        for row in rows:
+            # шрифт не моноширинный, поэтому каждая колонка выравнивается по правому краю отдельно
+            for column, text in enumerate(row):
+                rendered = self.font.render(text, 1, pygame.Color("black"))
+                if column:
+                    table.blit(rendered, rendered.get_rect(topright=(60 + column * 60, y)))
+                else:
+                    table.blit(rendered, (0, y))
+            y += line
+        return table
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
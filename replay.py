@@ -0,0 +1,100 @@
+"""Запись и воспроизведение ввода по кадрам
+
+Каждый кадр сжимается в два байта: битовая маска зажатых клавиш из KEYS и
+битовая маска событий (QUIT, DEBUG, MAGNET). Вместе с кадрами в файл пишутся
+seed для random, разрешение экрана (от него зависит масштаб, а с ним и физика)
+и уровень, с которого началась запись, так что воспроизведение повторяет игру
+один в один - в том числе разлёт монет из сундуков."""
+import struct
+import zlib
+
+import pygame
+
+MAGIC = b"PREC"
+VERSION = 1
+HEADER = struct.Struct("<4sIQHHH")  # магия, версия, seed, ширина и высота экрана, длина имени уровня
+FRAME = struct.Struct("<BB")  # зажатые клавиши, события
+
+# клавиши, которые читает игра; порядок задаёт биты в записи, менять только вместе с VERSION
+KEYS = (pygame.K_w, pygame.K_SPACE, pygame.K_s, pygame.K_a, pygame.K_d, pygame.K_LSHIFT, pygame.K_r, pygame.K_e)
+KEY_BITS = {key: 1 << i for i, key in enumerate(KEYS)}
+
+QUIT = 1  # закрыли окно или нажали Esc
+DEBUG = 2  # F1 - переключить отладочный режим
+MAGNET = 4  # сработал таймер COINS_MAGNET
+
+
+class FrameInput:
+    """Ввод одного кадра
+
+    Читается как pygame.key.get_pressed(): frame[pygame.K_a]
+
+    held - маска зажатых клавиш, events - маска событий"""
+
+    def __init__(self, held=0, events=0):
+        self.held = held
+        self.events = events
+
+    @classmethod
+    def from_pressed(cls, pressed, events=0):
+        """Из результата pygame.key.get_pressed()"""
+        held = 0
+        for key, bit in KEY_BITS.items():
+            if pressed[key]:
+                held |= bit
+        return cls(held, events)
+
+    def __getitem__(self, key):
+        return bool(self.held & KEY_BITS.get(key, 0))
+
+    def pack(self):
+        return FRAME.pack(self.held, self.events)
+
+
+class InputRecorder:
+    """Копит ввод по кадрам и сохраняет его в файл
+
+    path - куда сохранить, seed, size и level - с чего началась игра"""
+
+    def __init__(self, path, seed, size, level):
+        self.path = path
+        self.seed = seed
+        self.size = size
+        self.level = level
+        self.frames = bytearray()
+
+    def record(self, frame):
+        self.frames += frame.pack()
+
+    def save(self):
+        name = self.level.encode("utf-8")
+        with open(self.path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, self.seed, *self.size, len(name)))
+            file.write(name)
+            file.write(zlib.compress(bytes(self.frames), 9))
+
+
+class InputReplay:
+    """Отдаёт записанный ввод по кадру; когда запись кончилась, next() возвращает None"""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, version, self.seed, width, height, name_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: не запись ввода или запись другой версии")
+        self.size = (width, height)
+        start = HEADER.size + name_length
+        self.level = data[HEADER.size:start].decode("utf-8")
+        self.frames = zlib.decompress(data[start:])
+        self.position = 0
+
+    def __len__(self):
+        return len(self.frames) // FRAME.size
+
+    def next(self):
+        if self.position >= len(self.frames):
+            return None
+        held, events = FRAME.unpack_from(self.frames, self.position)
+        self.position += FRAME.size
+        return FrameInput(held, events)
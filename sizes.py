@@ -0,0 +1,32 @@
+"""Размеры на экране, которые зависят только от его ширины
+
+Нужны и игре, и compile_levels.py (под размер тайла компилируются уровни), поэтому
+живут отдельно от main: импорт не создаёт окна и не трогает состояние игры."""
+import os
+
+import pygame
+
+PLAYER_IMAGE = 'no anim2.png'  # картинка игрока в data, от её размера зависит размер тайла
+
+
+def screen_scale(screen_width):
+    """Сколько пикселей экрана в одном пикселе текстуры на экране шириной screen_width"""
+    return round((screen_width // 25) * 6 / (1920 // 25))
+
+
+def player_size(image_size, scale):
+    """Размер (w, h) картинки игрока с текстурой image_size, увеличенной в scale раз; высота всегда чётная"""
+    width = image_size[0] * scale
+    height = round((image_size[1] + 1) * scale)
+    if height % 2 != 0:
+        height -= 1
+        width -= 1
+    return width, height
+
+
+def tile_size(screen_width, data="data"):
+    """Размер тайла в пикселях (пол высоты игрока) на экране шириной screen_width
+
+    data - папка с картинками игры"""
+    image = pygame.image.load(os.path.join(data, PLAYER_IMAGE))
+    return player_size(image.get_size(), screen_scale(screen_width))[1] // 2
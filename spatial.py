@@ -0,0 +1,134 @@
+import itertools
+
+import pygame
+
+
+class SpatialGroup(pygame.sprite.Group):
+    """Группа спрайтов с равномерной сеткой (пространственным хешем)
+
+    Каждый спрайт записывается во все ячейки сетки, которые задевает его rect,
+    поэтому запрос по прямоугольнику смотрит только на соседей из этих ячеек,
+    а не на всю группу. Сетка обновляется сама при add/remove/kill.
+
+    Спрайты с always_active = True (или закреплённые через pin) в сетку не кладутся
+    и попадают в active() всегда, где бы они ни были.
+
+    cell_size - размер ячейки в пикселях (удобно брать размер тайла)"""
+
+    def __init__(self, *sprites, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> set спрайтов
+        self.sprite_cells = {}  # спрайт -> кортеж ячеек, в которых он лежит
+        self.pinned = set()  # спрайты, которые активны независимо от расстояния
+        self.order = {}  # спрайт -> порядковый номер добавления, чтобы рисовать в исходном порядке
+        self._counter = itertools.count()
+        super().__init__(*sprites)
+
+    def _cells_for(self, rect):
+        size = self.cell_size
+        x1, y1 = rect.left // size, rect.top // size
+        # правая и нижняя границы rect не входят в него, поэтому -1
+        x2, y2 = (rect.right - 1) // size, (rect.bottom - 1) // size
+        return tuple((cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1))
+
+    def _insert(self, sprite):
+        cells = self._cells_for(sprite.rect)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(sprite)
+        self.sprite_cells[sprite] = cells
+
+    def _discard(self, sprite):
+        for cell in self.sprite_cells.pop(sprite, ()):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(sprite)
+                if not bucket:
+                    del self.cells[cell]
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.order[sprite] = next(self._counter)
+        if getattr(sprite, "always_active", False):
+            self.pinned.add(sprite)
+        else:
+            self._insert(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.order.pop(sprite, None)
+        self.pinned.discard(sprite)
+        self._discard(sprite)
+
+    def reinsert(self, sprite, order):
+        """Возвращает убранный спрайт в группу на его прежнее место в порядке отрисовки"""
+        self.add(sprite)
+        self.order[sprite] = order
+
+    def reserve(self, count):
+        """Оставляет count мест в порядке отрисовки под спрайты, которые добавятся позже
+
+        Возвращает первый номер: спрайт с номером first + i встанет туда, где был бы,
+        если бы его добавили сейчас (после этого - через reinsert)"""
+        first = next(self._counter)
+        self._counter = itertools.count(first + count)
+        return first
+
+    def pin(self, sprite):
+        """Делает спрайт активным всегда (например, предмет, который летит за игроком)"""
+        if self.has(sprite) and sprite not in self.pinned:
+            self._discard(sprite)
+            self.pinned.add(sprite)
+
+    def unpin(self, sprite):
+        """Возвращает закреплённый спрайт обратно в сетку"""
+        if sprite in self.pinned and not getattr(sprite, "always_active", False):
+            self.pinned.discard(sprite)
+            self._insert(sprite)
+
+    def move(self, sprite):
+        """Пересчитывает ячейки спрайта после того, как сдвинули его rect"""
+        if sprite not in self.sprite_cells:
+            return
+        cells = self._cells_for(sprite.rect)
+        if cells != self.sprite_cells[sprite]:
+            self._discard(sprite)
+            self._insert(sprite)
+
+    def set_cell_size(self, cell_size):
+        """Меняет размер ячейки и перестраивает сетку"""
+        self.cell_size = cell_size
+        self.cells.clear()
+        self.sprite_cells.clear()
+        for sprite in self.sprites():
+            if sprite not in self.pinned:
+                self._insert(sprite)
+
+    def query(self, rect):
+        """Возвращает множество спрайтов из ячеек, которые задевает rect (кандидаты)"""
+        found = set()
+        for cell in self._cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket:
+                found |= bucket
+        return found
+
+    def active(self, rect, exclude=(), cull=False):
+        """Спрайты рядом с rect и закреплённые, в порядке добавления в группу
+
+        exclude - спрайты, которые не нужны (например, те, что двигает кто-то другой)
+
+        cull - из закреплённых брать только задевающие rect и всегда активные; иначе все"""
+        found = self.query(rect)
+        pinned = self.pinned
+        if exclude:
+            found.difference_update(exclude)
+            pinned = pinned.difference(exclude)
+        if cull:
+            pinned = {sprite for sprite in pinned
+                      if getattr(sprite, "always_active", False) or rect.colliderect(sprite.rect)}
+        return sorted(found | pinned, key=self.order.__getitem__)
+
+    def spritecollide(self, sprite):
+        """Аналог pygame.sprite.spritecollide(sprite, group, False), но только по соседним ячейкам"""
+        rect = sprite.rect
+        return [other for other in self.query(rect) if rect.colliderect(other.rect)]
@@ -0,0 +1,166 @@
+import numpy as np
+import pygame
+
+
+class Swarm(pygame.sprite.AbstractGroup):
+    """Стая предметов, которые летят к игроку (примагниченные монеты, подобранные ключи)
+
+    Вместо update у каждого спрайта позиции, ускорения и цели лежат в массивах NumPy
+    (структура массивов) и двигаются одним векторным шагом: за тик каждый предмет
+    проходит 1 / acc оставшегося до цели пути. Цель - центр игрока или предыдущий
+    предмет в цепочке (подобранные предметы летят друг за другом).
+
+    Спрайт попадает в стаю через add и уходит через remove/kill, как из обычной группы.
+    У спрайта должны быть rect, random_acc и shape (см. collision.touches), а у тех,
+    что летят цепочкой, ещё max_distance - на каком расстоянии от цели они отрываются."""
+
+    def __init__(self, capacity=64):
+        super().__init__()
+        self.members = []  # индекс в массивах -> спрайт
+        self.index = {}  # спрайт -> индекс в массивах
+        self.count = 0
+        self.pos = np.zeros((capacity, 2))  # центры
+        self.acc = np.ones(capacity)  # за сколько тиков (примерно) долетает до цели
+        self.follow = np.full(capacity, -1, dtype=np.intp)  # за кем летит: -1 - за игроком, иначе индекс в стае
+        self.leash = np.full(capacity, np.inf)  # на каком расстоянии от цели отрывается
+        self.center = np.zeros((capacity, 2), dtype=np.intp)  # центр, записанный в rect
+        self.last = np.zeros((capacity, 2), dtype=np.intp)  # центр до последнего шага (для интерполяции)
+        self.size = np.zeros((capacity, 2))  # размер rect
+        self.box = np.zeros((capacity, 4))  # хитбокс: left, top, right, bottom относительно левого верхнего угла rect
+        self.chain = ()  # цепочка, по которой сейчас расставлены follow
+
+    def _grow(self):
+        capacity = len(self.acc) * 2
+        for name in ("pos", "acc", "follow", "leash", "center", "last", "size", "box"):
+            array = getattr(self, name)
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        if self.count == len(self.acc):
+            self._grow()
+        i = self.count
+        self.count += 1
+        self.members.append(sprite)
+        self.index[sprite] = i
+        rect = sprite.rect
+        self.pos[i] = rect.center
+        self.center[i] = rect.center
+        self.last[i] = rect.center
+        self.acc[i] = sprite.random_acc
+        self.follow[i] = -1
+        self.leash[i] = np.inf
+        self.size[i] = rect.size
+        shape = sprite.shape
+        if isinstance(shape, pygame.Rect):
+            self.box[i] = shape.left, shape.top, shape.right, shape.bottom
+        elif isinstance(shape, pygame.mask.Mask) and shape.get_bounding_rects():
+            box = shape.get_bounding_rects()[0].unionall(shape.get_bounding_rects())
+            self.box[i] = box.left, box.top, box.right, box.bottom  # точная проверка - в hits()
+        else:
+            self.box[i] = 0, 0, rect.width, rect.height
+        self.chain = None  # индексы поменялись, цепочку надо расставить заново
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        i = self.index.pop(sprite)
+        last = self.count - 1
+        if i != last:  # на место убранного переезжает последний
+            moved = self.members[last]
+            self.members[i] = moved
+            self.index[moved] = i
+            for name in ("pos", "acc", "follow", "leash", "center", "last", "size", "box"):
+                array = getattr(self, name)
+                array[i] = array[last]
+        self.members.pop()
+        self.count = last
+        self.chain = None
+
+    def set_chain(self, chain):
+        """Расставляет цели: первый предмет цепочки летит за игроком, каждый следующий - за предыдущим
+
+        chain - подобранные предметы по порядку; остальные члены стаи летят к игроку и не отрываются"""
+        n = self.count
+        self.follow[:n] = -1
+        self.leash[:n] = np.inf
+        previous = -1
+        for sprite in chain:
+            i = self.index.get(sprite)
+            if i is None:
+                continue
+            self.follow[i] = previous
+            self.leash[i] = sprite.max_distance
+            previous = i
+        self.chain = tuple(chain)
+
+    def update(self, target, chain=()):
+        """Двигает всю стаю на тик к целям и переносит позиции в rect
+
+        target - центр игрока; chain - см. set_chain (цепочка перестраивается, только
+        если поменялась). Позиции до шага остаются в last для отрисовки между тиками (visible)
+
+        Возвращает спрайты, которые оторвались от цели дальше leash"""
+        n = self.count
+        if not n:
+            return []
+        self.last[:n] = self.center[:n]
+        chain = tuple(chain)
+        if chain != self.chain:
+            self.set_chain(chain)
+
+        pos = self.pos[:n]
+        follow = self.follow[:n]
+        # цели считаются по позициям до шага, так что порядок предметов в цепочке не важен
+        targets = np.where((follow < 0)[:, None], np.asarray(target, dtype=float), pos[follow])
+        delta = pos - targets
+        pos -= delta / self.acc[:n, None]
+
+        torn = np.flatnonzero((np.abs(delta) > self.leash[:n, None]).any(axis=1))
+
+        # в rect переносятся только сдвинувшиеся на пиксель и больше: долетевшие стоят и ничего не стоят
+        centers = np.rint(pos).astype(np.intp)
+        moved = np.flatnonzero((centers != self.center[:n]).any(axis=1))
+        self.center[:n] = centers
+        members = self.members
+        for i, center in zip(moved.tolist(), centers[moved].tolist()):
+            members[i].rect.center = center
+        return [self.members[i] for i in torn.tolist()]
+
+    def visible(self, view, alpha=1.0):
+        """Члены стаи, чей rect задевает view, и где их рисовать, одной векторной проверкой
+
+        alpha - доля пути от предыдущего тика к последнему, как у CameraGroup.lerp_pos
+
+        Возвращает (спрайты, массив N x 2 с левыми верхними углами в мировых координатах)"""
+        n = self.count
+        if not n:
+            return [], np.empty((0, 2))
+        half = self.size[:n] // 2
+        topleft = self.center[:n] - half  # как rect.center = ...
+        right_bottom = topleft + self.size[:n]
+        inside = (topleft[:, 0] < view.right) & (right_bottom[:, 0] > view.left) \
+            & (topleft[:, 1] < view.bottom) & (right_bottom[:, 1] > view.top)
+        shown = np.flatnonzero(inside)
+        topleft = topleft[shown]
+        last = self.last[shown] - half[shown]
+        position = np.rint(last + (topleft - last) * alpha)
+        return [self.members[i] for i in shown.tolist()], position
+
+    def hits(self, rect):
+        """Члены стаи, чей хитбокс пересекается с rect, одной векторной проверкой
+
+        Для попиксельных форм это только кандидаты по рамке маски, точно их проверяет вызывающий"""
+        n = self.count
+        if not n:
+            return []
+        topleft = self.center[:n] - self.size[:n] // 2  # как rect.center = ...
+        box = self.box[:n]
+        left = topleft[:, 0] + box[:, 0]
+        top = topleft[:, 1] + box[:, 1]
+        right = topleft[:, 0] + box[:, 2]
+        bottom = topleft[:, 1] + box[:, 3]
+        inside = (left < rect.right) & (right > rect.left) & (top < rect.bottom) & (bottom > rect.top)
+        inside &= (right > left) & (bottom > top)  # пустой хитбокс ни с чем не сталкивается
+        return [self.members[i] for i in np.flatnonzero(inside).tolist()]
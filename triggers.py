@@ -0,0 +1,56 @@
+from collision import touches
+from spatial import SpatialGroup
+
+
+class TriggerRegistry:
+    """Реестр объектов, которые реагируют на игрока
+
+    Объект регистрируется один раз (и заново, только когда меняется его состояние):
+    в touch - если что-то делает при касании (on_collision), в use - если его можно
+    использовать кнопкой (on_use). Раз в тик dispatch() спрашивает у реестра, что
+    рядом с игроком, вместо того чтобы каждый объект сам проверял игрока в update.
+    Убранные (kill) объекты пропадают из реестра сами.
+
+    cell_size - размер ячейки сетки в пикселях"""
+
+    def __init__(self, cell_size=64):
+        self.touch = SpatialGroup(cell_size=cell_size)
+        self.use = SpatialGroup(cell_size=cell_size)
+        self.highlighted = []  # объекты, у которых сейчас показана подсказка
+
+    def set_cell_size(self, cell_size):
+        self.touch.set_cell_size(cell_size)
+        self.use.set_cell_size(cell_size)
+
+    def register(self, sprite, touch, use):
+        """Записывает (или вычёркивает) объект в нужные части реестра"""
+        for group, wanted in ((self.touch, touch), (self.use, use)):
+            if wanted:
+                if not group.has(sprite):
+                    group.add(sprite)
+            elif group.has(sprite):
+                group.remove(sprite)
+
+    def move(self, sprite):
+        """Пересчитывает ячейки объекта, который сдвинулся"""
+        self.touch.move(sprite)
+        self.use.move(sprite)
+
+    def dispatch(self, rect, use_rect, use_pressed):
+        """Раздаёт события за тик
+
+        rect - прямоугольник игрока: всё, чего он касается, получает on_collision
+
+        use_rect - зона использования: у объектов в ней показывается подсказка,
+        а если use_pressed - вызывается on_use"""
+        for sprite in self.touch.active(rect):
+            if touches(sprite.shape, sprite.rect, rect):
+                sprite.on_collision()
+
+        for sprite in self.highlighted:
+            sprite.display_text = None
+        self.highlighted = [sprite for sprite in self.use.active(use_rect) if sprite.rect.colliderect(use_rect)]
+        for sprite in self.highlighted:
+            sprite.display_text = sprite.use_text
+            if use_pressed:
+                sprite.on_use()